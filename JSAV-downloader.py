@@ -27,12 +27,15 @@
 
 import csv
 from enum import Enum
-import json
 from pathlib import Path
 import requests
 import sys
 import time
 
+# JSON library selection shared with JSAV matcher. The directory of this
+# script is on the module search path, so matcher/ is a namespace package.
+from matcher import jsoncodec
+
 class ExerciseDownloader:
     def __init__(self, api_url_base, api_token):
         self.api_token = api_token
@@ -70,7 +73,7 @@ class ExerciseDownloader:
                 print("Are the API URL and the exercise ID correct?")
             return None
 
-        json_data = json.loads(response.content.decode('utf-8'))
+        json_data = jsoncodec.loads(response.content)
         result = {}
         result['exercise_name']   = json_data['display_name']
         result['course_code']     = json_data['course']['code']
@@ -110,7 +113,7 @@ class ExerciseDownloader:
         """
         response = requests.get(api_url, headers = self.headers)
         if response.status_code == 200:
-            json_data = json.loads(response.content.decode('utf-8'))
+            json_data = jsoncodec.loads(response.content)
             result['submissions'].extend(json_data['results'])
             result['count'] = json_data['count']
             if json_data['next'] is not None:
@@ -139,7 +142,7 @@ class ExerciseDownloader:
                 submission_url))
             return None
 
-        json_data = json.loads(response.content.decode('utf-8'))
+        json_data = jsoncodec.loads(response.content)
         if json_data == None:
             print("Error: invalid JSON data for {}".format(submission_url))
             return None
@@ -235,12 +238,12 @@ class ExerciseDownloader:
                "Metadata  : {}\n"
                "File name : {}").format(exercise_rq, exercise, file_name))
 
-        with open(file_name, 'w') as json_file:
+        with open(file_name, 'w', encoding='utf-8') as json_file:
             submissions = self.__get_submissions(exercise['submissions_url'])
 
             print("Found {} submissions.".format(submissions['count']))
 
-            metadata = json.dumps({
+            metadata = jsoncodec.dumps({
                 'id'       : exercise_rq.id,
                 'type'     : exercise_rq.name,
                 'longname' : exercise_rq.longname,
@@ -328,7 +331,7 @@ class ExerciseDL:
             self.year)
 
     def toJSON(self):
-        return json.dumps(self, default=lambda o: o.__dict__,
+        return jsoncodec.dumps(self, default=lambda o: o.__dict__,
             sort_keys=True, indent=4)
 
 print("A+ JSAV submission downloader ")
@@ -0,0 +1,399 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Batched candidate generation for Build-heap matching. Requires NumPy.
+#
+# BuildHeapMatcher.build_heap_variant() simulates one loop and heapify variant
+# for one input at a time. BatchHeapGenerator simulates a variant for a matrix
+# of inputs, one input on each row: each compare-and-swap step is performed
+# for all rows at once, and rows where no swap happens are masked out. The
+# swaps are the same as those of build_heap_variant().
+
+import numpy
+
+
+class BatchHeapGenerator:
+
+    def __init__(self, matcher):
+        # BuildHeapMatcher whose candidate cache is filled by prefill()
+        self.matcher = matcher
+
+        # Name of a heapify method of BuildHeapMatcher -> batched version
+        self.kernels = {
+            'min_heapify': self.min_heapify,
+            'no_recursion': self.no_recursion,
+            'delayed_recursion': self.delayed_recursion,
+            'heapify_with_father_lr': self.heapify_with_father_lr,
+            'heapify_with_father_lr_recursive':
+                self.heapify_with_father_lr_recursive,
+            'heapify_with_father_rl': self.heapify_with_father_rl,
+            'heapify_with_father_rl_recursive':
+                self.heapify_with_father_rl_recursive,
+            'heapify_up': self.heapify_up,
+            'max_heapify': self.max_heapify,
+            'wrong_duplicate': self.wrong_duplicate,
+            'path_bubblesort': self.path_bubblesort,
+            'smallest_instantly_up': self.smallest_instantly_up
+        }
+
+    def generate(self, main_loop, heapify, inputs, hashes = False):
+        """Runs a build-heap variant for several inputs of the same size.
+
+        Parameters:
+        main_loop: list of heap array indices for which a heapify function is
+                   called.
+        heapify:   a heapify method of BuildHeapMatcher
+        inputs:    list of input arrays of the same size, or a 2-dimensional
+                   array with one input on each row
+        hashes:    if True, also computes the hashes of the states with the
+                   ZobristHasher of the matcher. The inputs must be rank
+                   patterns, see BuildHeapMatcher.rank_pattern().
+
+        Returns:
+        list containing the swaps of each input, similar to
+        BuildHeapMatcher.build_heap_variant(). If hashes is True, returns
+        (swaps, hashes) where hashes contains the list of hashes of each
+        input.
+        """
+        kernel = self.kernels[heapify.__name__]
+        A = numpy.array(inputs, dtype = numpy.int64, ndmin = 2)
+        if hashes:
+            events = Events(A, self.matcher.zobrist)
+        else:
+            events = Events(A)
+        for i in main_loop:
+            kernel(A, i, events)
+        if hashes:
+            return (events.swaps(), events.hashes())
+        return events.swaps()
+
+    def prefill(self, inputs):
+        """Generates the candidates of all loop and heapify variants of the
+        matcher for the given inputs and stores them in the candidate cache
+        of the matcher. Inputs with the same rank pattern are simulated only
+        once.
+
+        Parameters:
+        inputs: list of input arrays
+
+        Returns:
+        number of rank patterns simulated
+        """
+        m = self.matcher
+
+        # Rank patterns by heap size
+        patterns = {}
+        for input in inputs:
+            ranks = m.rank_pattern(input)
+            patterns.setdefault(len(ranks), set()).add(ranks)
+
+        for (size, rows) in patterns.items():
+            rows = sorted(rows)
+            matrix = numpy.array(rows, dtype = numpy.int64)
+            for loop in m.loop_variants_for(size):
+                main_loop = tuple(loop[2])
+                for algo in m.heapify_algorithms:
+                    heapify = algo[2]
+                    (all_swaps, all_hashes) = self.generate(main_loop, heapify,
+                        matrix, hashes = True)
+                    for k in range(len(rows)):
+                        key = (rows[k], main_loop, heapify.__name__)
+                        m.candidate_cache.put(key,
+                            (all_swaps[k], all_hashes[k]))
+
+        return sum(len(rows) for rows in patterns.values())
+
+    #
+    # Batched heapify variants. Each one has parameters (A, i, events): A is
+    # the matrix of heap arrays, one on each row, and will be modified; i is
+    # the index in the heap arrays to begin; swaps are performed with
+    # events.swap(), which records them.
+    #
+
+    def descend(self, A, i, events, less, less_right, recursive = True,
+        mark_recursion = False):
+        """Common part of Min-heapify like variants: swaps the node with its
+        preferred child as long as the child is preferred.
+
+        Parameters:
+        less:       less(x, y) is True where child value x is preferred over
+                    father value y
+        less_right: the same for the right child and the preferred one of the
+                    father and the left child
+        recursive:  if False, performs only one swap
+        mark_recursion: if True, swaps are recorded as in delayed_recursion()
+        """
+        (R, n) = A.shape
+        rows = numpy.arange(R)
+        node = numpy.full(R, i)
+        first_instance = True
+        while len(rows) > 0:
+            l = 2 * node + 1
+            r = l + 1
+            target = node.copy()
+            target_value = A[rows, node]
+            value = A[rows, numpy.minimum(l, n - 1)]
+            m = (l < n) & less(value, target_value)
+            target[m] = l[m]
+            target_value[m] = value[m]
+            value = A[rows, numpy.minimum(r, n - 1)]
+            m = (r < n) & less_right(value, target_value)
+            target[m] = r[m]
+
+            m = target != node
+            (rows, node, target) = (rows[m], node[m], target[m])
+            if mark_recursion:
+                events.swap(A, rows, node, target, not first_instance)
+            else:
+                events.swap(A, rows, node, target)
+            if not recursive:
+                break
+            node = target
+            first_instance = False
+
+    def min_heapify(self, A, i, events):
+        self.descend(A, i, events, numpy.less, numpy.less)
+
+    def no_recursion(self, A, i, events):
+        self.descend(A, i, events, numpy.less, numpy.less, recursive = False)
+
+    def delayed_recursion(self, A, i, events):
+        self.descend(A, i, events, numpy.less, numpy.less,
+            mark_recursion = True)
+
+    def max_heapify(self, A, i, events):
+        self.descend(A, i, events, numpy.greater, numpy.greater)
+
+    def wrong_duplicate(self, A, i, events):
+        self.descend(A, i, events, numpy.less, numpy.less_equal)
+
+    def heapify_with_father(self, A, i, events, children):
+        """Heapify-with-father without recursion: compares the father with
+        each child in the given order."""
+        n = A.shape[1]
+        for c in children:
+            if c < n:
+                rows = numpy.flatnonzero(A[:, c] < A[:, i])
+                events.swap(A, rows, i, c)
+
+    def heapify_with_father_lr(self, A, i, events):
+        self.heapify_with_father(A, i, events, (2 * i + 1, 2 * i + 2))
+
+    def heapify_with_father_rl(self, A, i, events):
+        self.heapify_with_father(A, i, events, (2 * i + 2, 2 * i + 1))
+
+    def heapify_with_father_recursive(self, A, i, events, offsets):
+        """Heapify-with-father with recursion. The recursion is simulated
+        with a stack of (node, phase) frames for each row. Phase k means
+        that the child with offsets[k] is compared next; phase 2 means that
+        the frame is finished. Each step either pops a frame or compares
+        the father with one child, pushing a new frame after a swap."""
+        (R, n) = A.shape
+        depth = n.bit_length() + 2
+        node = numpy.zeros((R, depth), dtype = numpy.int64)
+        phase = numpy.zeros((R, depth), dtype = numpy.int64)
+        top = numpy.zeros(R, dtype = numpy.int64)
+        node[:, 0] = i
+        rows = numpy.arange(R)
+        while len(rows) > 0:
+            x = node[rows, top[rows]]
+            p = phase[rows, top[rows]]
+            finished = p >= 2
+            top[rows[finished]] -= 1
+
+            m = ~finished
+            (rows, x, p) = (rows[m], x[m], p[m])
+            phase[rows, top[rows]] += 1
+            c = 2 * x + numpy.where(p == 0, offsets[0], offsets[1])
+            m = (c < n) & (A[rows, numpy.minimum(c, n - 1)] < A[rows, x])
+            (rows, x, c) = (rows[m], x[m], c[m])
+            events.swap(A, rows, x, c)
+            top[rows] += 1
+            node[rows, top[rows]] = c
+            phase[rows, top[rows]] = 0
+
+            rows = numpy.flatnonzero(top >= 0)
+
+    def heapify_with_father_lr_recursive(self, A, i, events):
+        self.heapify_with_father_recursive(A, i, events, (1, 2))
+
+    def heapify_with_father_rl_recursive(self, A, i, events):
+        self.heapify_with_father_recursive(A, i, events, (2, 1))
+
+    def heapify_up(self, A, i, events):
+        (R, n) = A.shape
+        rows = numpy.arange(R)
+        node = numpy.full(R, i)
+        while len(rows) > 0 and i >= 0:
+            l = 2 * node + 1
+            r = l + 1
+            target = node.copy()
+            target_value = A[rows, node]
+            value = A[rows, numpy.minimum(l, n - 1)]
+            m = (l < n) & (value < target_value)
+            target[m] = l[m]
+            target_value[m] = value[m]
+            value = A[rows, numpy.minimum(r, n - 1)]
+            m = (r < n) & (value < target_value)
+            target[m] = r[m]
+
+            m = target != node
+            (rows, node, target) = (rows[m], node[m], target[m])
+            events.swap(A, rows, node, target)
+
+            # Continue from the father, unless the node was the root
+            node = (node - 1) // 2
+            m = node >= 0
+            (rows, node) = (rows[m], node[m])
+
+    def path_bubblesort(self, A, i, events):
+        (R, n) = A.shape
+        l = 2 * i + 1
+        r = l + 1
+        smallest = numpy.full(R, i)
+        if l < n:
+            smallest[A[:, l] < A[:, i]] = l
+        if r < n:
+            smallest[A[:, r] < A[numpy.arange(R), smallest]] = r
+
+        ancestors = [i]
+        while ancestors[-1] > 0:
+            ancestors.append((ancestors[-1] - 1) // 2)
+
+        # Rows where the path begins from a child of i, and rows where it
+        # begins from i. The paths have the same length within each group.
+        for with_child in (True, False):
+            rows = numpy.flatnonzero((smallest != i) == with_child)
+            if len(rows) == 0:
+                continue
+            path = numpy.empty((len(rows), len(ancestors) + with_child),
+                dtype = numpy.int64)
+            if with_child:
+                path[:, 0] = smallest[rows]
+            path[:, int(with_child):] = ancestors
+
+            k = path.shape[1]
+            for p in range(k - 1):
+                for j in range(k - 1 - p):
+                    index1 = path[:, j]
+                    index2 = path[:, j + 1]
+                    m = A[rows, index1] < A[rows, index2]
+                    events.swap(A, rows[m], index2[m], index1[m])
+
+    def smallest_instantly_up(self, A, i, events):
+        # Subtree of i in preorder. numpy.argmin() chooses the first of equal
+        # minimums, which is the first one in preorder, as in
+        # BuildHeapMatcher.subtree_min_index().
+        n = A.shape[1]
+        preorder = []
+        stack = [i]
+        while stack:
+            j = stack.pop()
+            if j < n:
+                preorder.append(j)
+                stack.extend((2 * j + 2, 2 * j + 1))
+        preorder = numpy.array(preorder, dtype = numpy.int64)
+
+        j = preorder[numpy.argmin(A[:, preorder], axis = 1)]
+        rows = numpy.flatnonzero(j != i)
+        events.swap(A, rows, i, j[rows])
+
+
+# Swaps performed by the batched heapify variants. The swaps of each step are
+# performed and recorded for all rows at once and grouped by row in swaps().
+class Events:
+
+    def __init__(self, A, zobrist = None):
+        self.row_count = A.shape[0]
+        self.rows = []
+        self.first = []
+        self.second = []
+        self.recursive = []     # None if swaps have no recursion marks
+
+        # ZobristHasher for hashes(), or None if hashes are not computed
+        self.zobrist = zobrist
+        if zobrist is not None:
+            index = numpy.arange(A.shape[1])
+            self.initial_hashes = numpy.bitwise_xor.reduce(
+                zobrist.keys(index, A), axis = 1)
+            self.hash_changes = []
+
+    def swap(self, A, rows, first, second, recursive = None):
+        """Swaps A[rows, first] and A[rows, second] and records the swaps
+        (first, second) for the given rows. first and second are arrays or
+        single indices. If recursive is not None, the swaps are recorded as
+        tuples (first, second, recursive)."""
+        k = len(rows)
+        if k == 0:
+            return
+        (a, b) = (A[rows, first], A[rows, second])
+        A[rows, first] = b
+        A[rows, second] = a
+
+        first = numpy.broadcast_to(first, k)
+        second = numpy.broadcast_to(second, k)
+        self.rows.append(rows)
+        self.first.append(first)
+        self.second.append(second)
+        self.recursive.append(None if recursive is None else
+            numpy.full(k, recursive))
+        if self.zobrist is not None:
+            keys = self.zobrist.keys
+            self.hash_changes.append(keys(first, a) ^ keys(second, b) ^
+                keys(first, b) ^ keys(second, a))
+
+    def swaps(self):
+        """Returns the list of swaps of each row."""
+        result = [[] for r in range(self.row_count)]
+        if not self.rows:
+            return result
+
+        (rows, order, ends) = self.grouping()
+        columns = [numpy.concatenate(self.first)[order].tolist(),
+                   numpy.concatenate(self.second)[order].tolist()]
+        if self.recursive[0] is not None:
+            columns.append(numpy.concatenate(self.recursive)[order].tolist())
+        swaps = list(zip(*columns))
+
+        start = 0
+        for r in range(self.row_count):
+            result[r] = swaps[start : ends[r]]
+            start = ends[r]
+        return result
+
+    def hashes(self):
+        """Returns the list of Zobrist hashes of the states of each row, the
+        same as ZobristHasher.hash_sequence() of the initial row and its
+        swaps."""
+        initial = self.initial_hashes.tolist()
+        if not self.rows:
+            return [[h] for h in initial]
+
+        # Cumulative exclusive or of the changes over all rows. The hashes of
+        # a row are the changes from the beginning of the row.
+        (rows, order, ends) = self.grouping()
+        changes = numpy.concatenate(self.hash_changes)[order]
+        cumulative = numpy.bitwise_xor.accumulate(changes)
+        starts = numpy.concatenate(([0], ends[:-1]))
+        before = numpy.where(starts > 0,
+            cumulative[numpy.maximum(starts - 1, 0)], 0)
+        cumulative ^= numpy.repeat(before ^ self.initial_hashes,
+            ends - starts)
+        cumulative = cumulative.tolist()
+
+        result = []
+        start = 0
+        for r in range(self.row_count):
+            end = ends[r]
+            result.append([initial[r]] + cumulative[start : end])
+            start = end
+        return result
+
+    def grouping(self):
+        """Returns (rows, order, ends): rows of all swaps, the order which
+        groups the swaps by row keeping their order, and the end index of
+        each group."""
+        rows = numpy.concatenate(self.rows)
+        order = numpy.argsort(rows, kind = 'stable')
+        ends = numpy.cumsum(numpy.bincount(rows, minlength = self.row_count))
+        return (rows, order, ends)
@@ -0,0 +1,189 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Micro-benchmarks for JSAV matcher.
+#
+# Usage: python3 benchmarks.py <benchmark> [file.json]
+#
+# Without a file, the benchmarks use a synthetic Build-heap exercise file of
+# the same size as a real course instance.
+
+import os
+import random
+import sys
+import tempfile
+import timeit
+
+from buildheap import BuildHeapMatcher
+import jsoncodec
+
+
+def synthetic_exercise(submission_count = 1500, heap_size = 10, seed = 1):
+    """Creates a JSAV inspector file structure with Build-heap submissions.
+
+    Each submission follows some loop and heapify variant of
+    BuildHeapMatcher. Most of them use the correct variant, some are
+    unfinished and some have a random extra swap, as in real data. As in JSAV
+    recordings, each swap is preceded by a step which only selects a node.
+
+    Returns:
+    dict similar to the JSON data of a file written by JSAV-downloader.py
+    """
+    rnd = random.Random(seed)
+    m = BuildHeapMatcher()
+    submissions = []
+    for k in range(submission_count):
+        input = rnd.sample(range(10, 100), heap_size)
+        if rnd.random() < 0.7:
+            loop, algo = m.loop_variants[0], m.heapify_algorithms[0]
+        else:
+            loop = rnd.choice(m.loop_variants)
+            algo = rnd.choice(m.heapify_algorithms)
+        states, swaps = m.build_heap_variant(loop[2], algo[2], input)
+        swaps = [s[0:2] for s in swaps]
+        if rnd.random() < 0.2:
+            swaps = swaps[0 : rnd.randint(0, len(swaps))]
+        if rnd.random() < 0.2:
+            swaps.insert(rnd.randint(0, len(swaps)),
+                tuple(rnd.sample(range(heap_size), 2)))
+
+        A = list(input)
+        steps = [list(A)]
+        for s in swaps:
+            steps.append(list(A))
+            A[s[0]], A[s[1]] = A[s[1]], A[s[0]]
+            steps.append(list(A))
+        recording = [{'ind': [{'v': x} for x in step],
+                      'style': 'height: 60px; width: 301px;',
+                      'classes': ['jsavcenter']} for step in steps]
+        submissions.append({'id': 1000000 + k,
+                            'submitter': rnd.randint(1, submission_count // 3),
+                            'points': 4, 'max_points': 5,
+                            'recording': recording})
+
+    return {'application': 'JSAV Inspector', 'version': 1,
+            'metadata': {'type': 'buildheap', 'longname': 'Heap build',
+                         'year': 'synthetic', 'course_code': 'synthetic',
+                         'course_name': 'synthetic',
+                         'course_instance': 'synthetic'},
+            'submissions': submissions}
+
+
+def exercise_file(file_name = None):
+    """Returns file_name, or the name of a temporary file containing
+    synthetic_exercise() if file_name is None."""
+    if file_name is not None:
+        return file_name
+    f = tempfile.NamedTemporaryFile('w', suffix = '.json', delete = False)
+    f.write(jsoncodec.dumps(synthetic_exercise()))
+    f.close()
+    return f.name
+
+
+def benchmark_json(file_name = None):
+    """Decoding and encoding time of an exercise file for each installed JSON
+    library."""
+    path = exercise_file(file_name)
+    with open(path, 'rb') as f:
+        data = f.read()
+    print("{}: {:.1f} MB".format(file_name or 'synthetic exercise',
+        len(data) / 1e6))
+    print("Selected library: {}".format(jsoncodec.name_selected))
+    print("{:8} {:>10} {:>10}".format('library', 'loads (s)', 'dumps (s)'))
+    for name in sorted(jsoncodec.codecs):
+        (loads, dumps) = jsoncodec.codecs[name]
+        t_loads = min(timeit.repeat(lambda: loads(data), number = 1,
+            repeat = 5))
+        obj = loads(data)
+        t_dumps = min(timeit.repeat(lambda: dumps(obj), number = 1,
+            repeat = 5))
+        print("{:8} {:10.3f} {:10.3f}".format(name, t_loads, t_dumps))
+    if file_name is None:
+        os.remove(path)
+
+
+def benchmark_parse(file_name = None):
+    """Parsing time of recordings of different lengths with and without
+    NumPy."""
+    m = BuildHeapMatcher()
+    rnd = random.Random(1)
+    print("{:>6} {:>12} {:>12}".format('steps', 'Python (us)', 'NumPy (us)'))
+    for swap_count in (10, 50, 100, 1000, 10000):
+        A = list(range(10))
+        steps = [tuple(A)]
+        for k in range(swap_count):
+            steps.append(tuple(A))
+            i, j = rnd.sample(range(len(A)), 2)
+            A[i], A[j] = A[j], A[i]
+            steps.append(tuple(A))
+        m.vectorized_parse_steps = len(steps) + 1
+        t_python = min(timeit.repeat(lambda: m.parse_steps(steps),
+            number = 10, repeat = 5)) / 10
+        t_numpy = min(timeit.repeat(lambda: m.parse_steps_vectorized(steps),
+            number = 10, repeat = 5)) / 10
+        print("{:6} {:12.1f} {:12.1f}".format(len(steps), t_python * 1e6,
+            t_numpy * 1e6))
+
+
+def benchmark_kernels(file_name = None):
+    """Time of Build-heap with the recursive and iterative heapify kernels of
+    BuildHeapMatcher for heaps of 10 to 10^5 elements. Smallest-instantly-up
+    searches whole subtrees, so it is only measured on smaller heaps."""
+    m = BuildHeapMatcher()
+    rnd = random.Random(1)
+    names = ['min_heapify', 'delayed_recursion',
+             'heapify_with_father_lr_recursive',
+             'heapify_with_father_rl_recursive',
+             'heapify_up', 'max_heapify', 'wrong_duplicate',
+             'smallest_instantly_up']
+    print("{:>6} {:33} {:>16} {:>16}".format('size', 'kernel',
+        'recursive (ms)', 'iterative (ms)'))
+    for size in (10, 100, 1000, 10000, 100000):
+        input = [rnd.randint(0, size) for k in range(size)]
+        for name in names:
+            if name == 'smallest_instantly_up' and size > 1000:
+                continue
+            heapify = getattr(m, name)
+            main_loop = m.loop_variants_for(size)[0][2]
+            repeat = max(1, 10000 // size)
+
+            def build_heap():
+                A = list(input)
+                swaps = []
+                for i in main_loop:
+                    heapify(A, i, None, swaps)
+
+            times = []
+            for iterative in (False, True):
+                m.iterative_kernels = iterative
+                times.append(min(timeit.repeat(build_heap, number = repeat,
+                    repeat = 3)) / repeat)
+            print("{:6} {:33} {:16.3f} {:16.3f}".format(size, name,
+                times[0] * 1e3, times[1] * 1e3))
+        for name in ('min_heap_property', 'subtree_min_index'):
+            A = sorted(input)
+            if name == 'min_heap_property':
+                run = lambda: m.min_heap_property(A, 0)
+            else:
+                run = lambda: m.subtree_min_index(A, 0, size + 1, -1)
+            times = []
+            for iterative in (False, True):
+                m.iterative_kernels = iterative
+                times.append(min(timeit.repeat(run, number = repeat,
+                    repeat = 3)) / repeat)
+            print("{:6} {:33} {:16.3f} {:16.3f}".format(size, name,
+                times[0] * 1e3, times[1] * 1e3))
+
+
+benchmarks = {
+    'json': benchmark_json,
+    'kernels': benchmark_kernels,
+    'parse': benchmark_parse,
+    }
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print("Usage: {} <benchmark> [file.json]".format(sys.argv[0]))
+        print("Benchmarks: {}".format(', '.join(sorted(benchmarks))))
+    else:
+        benchmarks[sys.argv[1]](*sys.argv[2:])
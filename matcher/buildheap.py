@@ -1,14 +1,28 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import array
+import bisect
+import collections
 import copy
+import itertools
+import random
+
+from dtw import dtw_distances
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class BuildHeapMatcher:
 
     def __init__(self):
         # Sequential definitions of main loop variants for 10-element
         # Build-heap. Each sequence of five numbers refers to the build-heap
-        # array indices for which the Heapify procedure is called.
+        # array indices for which the Heapify procedure is called. Variants
+        # for other heap sizes are generated by MainLoopGenerator; see
+        # loop_variants_for().
         self.loop_variants = (
             # code, name, sequence
             (100, 'Correct',            (4, 3, 2, 1, 0)), # also "Level LR"
@@ -44,6 +58,74 @@ class BuildHeapMatcher:
 
         self.compute_class_preferences()
 
+        # Loop variants for heap sizes other than 10
+        self.loop_generator = MainLoopGenerator()
+
+        # Recordings with at least this many steps are parsed with
+        # parse_steps_vectorized() if NumPy is installed. Shorter ones are
+        # faster to parse without NumPy.
+        self.vectorized_parse_steps = 100
+
+        # Parsed recordings by submission id or recording object id:
+        # key -> (recording, (input, states, swaps)). See parsed_recording().
+        self.parse_cache = {}
+
+        # Candidate sequences generated by build_heap_variant(), shared by
+        # match(), loop_hypothesis_match() and replicated_study_match(). The
+        # keys are rank patterns of inputs, not the input values.
+        self.candidate_cache = CandidateCache()
+
+        # (input, ranks of the input values) of the latest input of
+        # build_heap_variant(), which is called for all candidates of an input
+        self.input_ranks = (None, None)
+
+        # True: the heapify variants and other kernels which recurse along
+        # the tree, such as min_heapify(), run as loops. False: they call the
+        # recursive implementations, such as min_heapify_rec(), instead. Both
+        # produce the same swaps.
+        self.iterative_kernels = True
+
+        # smallest_instantly_up() finds subtree minimums with a
+        # SubtreeMinimumTree on heaps of at least this many elements, instead
+        # of searching the subtree. The tree follows the swaps of
+        # smallest_instantly_up() on one heap array; it is built again when
+        # the method is called with another array. A heap array must not be
+        # modified otherwise between the calls.
+        self.subtree_minimum_size = 32
+        self.subtree_minimum = None
+
+        # If True, match() merges the candidates of an input into a
+        # CandidateTrie and computes their similarities in one traversal.
+        self.candidate_trie = True
+
+        # (input, states, hashes, index) of the latest student's sequence,
+        # see student_index()
+        self.student_states = (None, None, None, None)
+
+        # (input, states, columns, distances) of the latest student's
+        # sequence for the 'dtw' similarity, see state_distances()
+        self.student_distances = (None, None, None, None)
+
+        # lcs() uses lcs_hunt_szymanski() if at most this fraction of the pairs
+        # of elements match
+        self.lcs_sparse_density = 0.4
+
+        # If True, lcs_similarity() and match() compute LCS lengths with
+        # lcs_length_banded(), starting from a band of lcs_band times the
+        # length of the shorter sequence. The banded lengths are exact only
+        # when the alignment stays in the band. For a 15-swap candidate and a
+        # student's sequence of 8000 swaps, the band took 2 ms with the
+        # candidate's swaps spread evenly and 9 ms spread randomly, versus
+        # 30 ms for lcs_table() and 3 ms for the bit-parallel lcs_length().
+        self.banded_lcs = False
+        self.lcs_band = 0.25
+
+        # lcs_hirschberg() stores the rows of the LCS table for subproblems
+        # of at most this many cells instead of dividing them further.
+        self.lcs_table_cells = 100000
+
+        # Hashes of heap states. See state_hashes().
+        self.zobrist = ZobristHasher()
 
         # For delayed recursion which uses and compute_level_indices().
         self.heap_levels = []
@@ -51,7 +133,8 @@ class BuildHeapMatcher:
 
         # Statistics for matching
         self.statistics = {
-            'cross-match': [0] * (13 * 13), # Replicated study algo variants
+            # Replicated study algo variants, a V x V matrix
+            'cross-match': [0] * (len(self.replicated_study_variants(10)) ** 2),
             'misconception-as-correct': 0,
             'multiple-misconceptions': 0,
             'total-matched': 0
@@ -174,6 +257,13 @@ class BuildHeapMatcher:
         self.heap_levels = level_indices
         self.assumed_heap_size = heap_size
 
+    def loop_variants_for(self, N):
+        """Returns the main loop variants for heap size N in the same form as
+        self.loop_variants."""
+        if N == 10:
+            return self.loop_variants
+        return self.loop_generator.loop_variants(N)
+
     def describe_variants(self):
         print("The following Build-heap variants have been defined.")
         print("Code, loop, heapify")
@@ -202,16 +292,29 @@ class BuildHeapMatcher:
             swaps: list of pairs of integers, each referring to array indices
                    involved in a swap
         """
-        steps = len(recording)
+        steps = [[x['v'] for x in step['ind']] for step in recording]
+        return self.parse_steps(steps)
+
+    def parse_steps(self, steps):
+        """Computes the compact representation of a Build-heap recording from
+        the heap array values of its steps.
+
+        Parameters:
+        steps (list): list of sequences of integers, each containing the heap
+            array after one step of the recording. See
+            recording_scanner.scan_file().
+
+        Returns:
+        (input, states, swaps) similar to parse_recording()
+        """
+        if numpy is not None and len(steps) >= self.vectorized_parse_steps:
+            return self.parse_steps_vectorized(steps)
 
         # Size of the binary heap
-        array_size = len(recording[0]['ind'])
+        array_size = len(steps[0])
 
         # Input of the exercise
-        input = []
-        for x in recording[0]['ind']:
-            input.append(x['v'])
-
+        input = list(steps[0])
 
         # Actual swaps performed.
         # Note that JSAV might record some steps redundant, as all the user's
@@ -219,10 +322,8 @@ class BuildHeapMatcher:
         swaps = []
         states = [tuple(input)]
         heap_array_prev = input
-        for i in range(1, steps):
-            heap_array = []
-            for x in recording[i]['ind']:
-                heap_array.append(x['v'])
+        for i in range(1, len(steps)):
+            heap_array = steps[i]
 
             swapped = []    # contains array indices of swaps
             for j in range(array_size):
@@ -235,9 +336,86 @@ class BuildHeapMatcher:
 
         return (input, states, swaps)
 
+    def parse_steps_vectorized(self, steps):
+        """Same as parse_steps(), but compares all consecutive steps at once
+        with NumPy. Requires NumPy."""
+
+        # Row i contains the heap array after step i
+        array_size = len(steps[0])
+        V = numpy.fromiter(itertools.chain.from_iterable(steps),
+            dtype = numpy.int64, count = len(steps) * array_size)
+        V = V.reshape(len(steps), array_size)
+
+        # changed[i][j] == True if array index j changed in step i + 1
+        changed = V[1:] != V[:-1]
+
+        # Steps where exactly two array indices changed are swaps
+        swap_steps = numpy.flatnonzero(changed.sum(axis = 1) == 2)
+        swap_indices = numpy.nonzero(changed[swap_steps])[1].reshape(-1, 2)
+
+        input = list(steps[0])
+        states = [tuple(input)]
+        states.extend(tuple(steps[i + 1]) for i in swap_steps.tolist())
+        swaps = list(zip(*swap_indices.T.tolist()))
+        return (input, states, swaps)
+
+    def parsed_recording(self, recording, submission_id = None):
+        """Returns the compact representation of a recording. Each recording
+        is parsed only once; the result is stored in self.parse_cache.
+
+        Parameters:
+        recording: either a JSAV recording (list), see parse_recording(), or
+                   a tuple (input, states, swaps) which has already been
+                   parsed.
+        submission_id: identifier of the submission, or None. A cached
+                   result is used only for the same recording object, as
+                   files appended to the data may repeat a submission id
+                   with a different recording.
+
+        Returns:
+        (input, states, swaps), see parse_recording()
+        """
+        if isinstance(recording, tuple):
+            return recording
+
+        if submission_id is not None:
+            key = submission_id
+        else:
+            key = id(recording)
+        if key in self.parse_cache:
+            (cached_recording, parsed) = self.parse_cache[key]
+            # An object id can be reused after the original object is freed,
+            # but not while the cache refers to it.
+            if cached_recording is recording:
+                return parsed
+
+        parsed = self.parse_recording(recording)
+        self.parse_cache[key] = (recording, parsed)
+        return parsed
+
+    def invalidate_parsed(self, submission_id = None, recording = None):
+        """Removes parsed recordings from self.parse_cache.
+
+        Parameters:
+        submission_id: removes the recording of this submission
+        recording:     removes this recording, if it was parsed without a
+                       submission id
+        If both are None, removes all recordings.
+        """
+        if submission_id is None and recording is None:
+            self.parse_cache = {}
+            return
+        if submission_id is not None:
+            self.parse_cache.pop(submission_id, None)
+        if recording is not None:
+            entry = self.parse_cache.get(id(recording))
+            if entry is not None and entry[0] is recording:
+                del self.parse_cache[id(recording)]
+
 
     def match(self, recording, options = {'similarity': 'states',
-        'Jaccard': False, 'threshold': 0, 'verbosity': 0}, debug_text = []):
+        'Jaccard': False, 'threshold': 0, 'verbosity': 0}, debug_text = [],
+        submission_id = None):
         """Matches a JSAV recording of build-heap exercise to known
         misconceived algorithms.
 
@@ -247,16 +425,20 @@ class BuildHeapMatcher:
                    x is a value in an array storing the binary heap.
             'style': string, ignored
             'classes': string, ignored
+            Alternatively, a tuple (input, states, swaps) returned by
+            parse_recording().
 
         options: optional dictionary
             'similarity': similarity algorithm for student's submission and
             |             result of misconceived algorithm
             +-- 'states': state-based similarity algorithm
             +-- 'lcs'   : longest common subsequence of swaps
-            +-- 'dtw'   : dynamic time warping of swaps
+            +-- 'dtw'   : dynamic time warping of states with Hamming
+                          distance d between them; the similarity is
+                          1 / (1 + d). Requires NumPy.
 
             'Jaccard': use Jaccard similarity coefficient with the similarity
-                       algorithm; either True or False.
+                       algorithm; either True or False. Ignored with 'dtw'.
 
             'threshold':
                 'Jaccard' == False: if the best matching candidate sequence
@@ -273,53 +455,106 @@ class BuildHeapMatcher:
         debug_text = a list. If options['verbosity'] != 0, appends a string
            to this list describing details of the classification.
 
+        submission_id: identifier of the submission, or None. Used for
+           caching the parsed recording; see parsed_recording().
+
         """
 
-        input, states, swaps = self.parse_recording(recording)
+        input, states, swaps = self.parsed_recording(recording, submission_id)
+        (hashes, index) = self.student_index(input, states)
+        if options['similarity'] == 'dtw' and numpy is None:
+            raise Exception("Similarity algorithm 'dtw' requires NumPy")
 
         best_similarity = 0 # The initial state will always match
         best_classes = [0]  # The "unknown" class
 
-        for loop in self.loop_variants:
+        # Candidates: (class code, loop, algo, states, swaps, index in trie)
+        candidates = []
+        trie = None
+        if (self.candidate_trie and (options['similarity'] == 'states' or
+            (options['similarity'] == 'lcs' and not self.banded_lcs))):
+            trie = CandidateTrie()
+        for loop in self.loop_variants_for(len(input)):
             for algo in self.heapify_algorithms:
-                class_code = loop[0] + algo[0]
-
                 algo_states, algo_swaps = self.build_heap_variant(loop[2],
                     algo[2], input)
-                #print("{}: {} / {}".format(class_code, loop[1], algo[1]))
-                #self.print_heap_sequence(algo_states, algo_swaps)
-
-                m = 0
-                len_algo = 0.1
-                len_states = 0.1
-                if (algo[1] == 'Delayed recursion'):
-                    m = 1 + self.lcs_similarity_delayed_recursion(algo_swaps,
-                                                                  swaps)
-                else:
+                k = None
+                if trie is not None and algo[1] != 'Delayed recursion':
                     if options['similarity'] == 'states':
-                        m = self.state_similarity(algo_states, states)
-                        len_algo = len(algo_states)
-                        len_states = len(states)
-                    elif options['similarity'] == 'lcs':
-                        m = self.lcs_similarity(algo_swaps, swaps)
-                        len_algo = len(algo_swaps)
-                        len_states = len(swaps)
+                        k = trie.add(algo_states.hashes, algo_states)
                     else:
-                        raise Exception(
-                            "Similarity algorithm '{}' not implemented"
-                            .format(options['similarity']))
-
-                if options['Jaccard'] == True:
-                    # Jaccard similarity coefficient:
-                    # J(X,Y) = |X union Y| / |X intersection Y|
-                    # = similarity(X,Y) / (len(X) + len(Y) - similarity(X,Y)
-                    m /= (len_algo + len_states - m)
-
-                if (m > best_similarity):
-                    best_classes = [class_code]
-                    best_similarity = m
-                elif (m == best_similarity):
-                    best_classes.append(class_code)
+                        k = trie.add(algo_swaps)
+                candidates.append((loop[0] + algo[0], loop, algo,
+                    algo_states, algo_swaps, k))
+
+        if trie is not None:
+            if options['similarity'] == 'states':
+                similarities = trie.state_similarity(states, index)
+            else:
+                similarities = trie.lcs_similarity(swaps)
+        elif options['similarity'] == 'dtw':
+            (columns, distances) = self.state_distances(input, states,
+                [candidate[3] for candidate in candidates])
+
+        # The candidates are evaluated in the order of class preference, so
+        # that the likely classes raise best_similarity early. A candidate
+        # whose similarity cannot reach best_similarity is skipped; ties are
+        # still evaluated, so best_classes gets the same classes.
+        for position in self.preference_order(candidates):
+            (class_code, loop, algo, algo_states, algo_swaps, k) = \
+                candidates[position]
+            #print("{}: {} / {}".format(class_code, loop[1], algo[1]))
+            #self.print_heap_sequence(algo_states, algo_swaps)
+
+            m = 0
+            len_algo = 0.1
+            len_states = 0.1
+            if options['similarity'] == 'dtw':
+                # Delayed recursion is compared by its states, too, so that
+                # all similarities are on the same scale
+                m = self.dtw_similarity(algo_states.hashes, columns,
+                    distances)
+            elif (algo[1] == 'Delayed recursion'):
+                m = 1 + self.lcs_similarity_delayed_recursion(algo_swaps,
+                                                              swaps)
+            else:
+                if options['similarity'] == 'states':
+                    len_algo = len(algo_states)
+                    len_states = len(states)
+                elif options['similarity'] == 'lcs':
+                    len_algo = len(algo_swaps)
+                    len_states = len(swaps)
+                else:
+                    raise Exception(
+                        "Similarity algorithm '{}' not implemented"
+                        .format(options['similarity']))
+
+                if k is not None:
+                    m = similarities[k]
+                elif self.similarity_bound(options['similarity'],
+                    options['Jaccard'], len_algo, len_states) < best_similarity:
+                    continue
+                elif options['similarity'] == 'states':
+                    m = self.state_similarity(algo_states, states,
+                        algo_states.hashes, hashes, index)
+                else:
+                    m = self.lcs_similarity(algo_swaps, swaps)
+
+            if options['Jaccard'] == True and options['similarity'] != 'dtw':
+                # Jaccard similarity coefficient:
+                # J(X,Y) = |X union Y| / |X intersection Y|
+                # = similarity(X,Y) / (len(X) + len(Y) - similarity(X,Y)
+                m /= (len_algo + len_states - m)
+
+            if (m > best_similarity):
+                best_classes = [class_code]
+                best_similarity = m
+            elif (m == best_similarity):
+                best_classes.append(class_code)
+
+        # Restore the order of the candidates
+        positions = {candidates[k][0]: k for k in range(len(candidates))}
+        best_classes.sort(key = lambda c: positions.get(c, -1))
 
         chosen_class = 0
         # Choose naively the first class from equal candidates
@@ -366,9 +601,44 @@ class BuildHeapMatcher:
         #        delayed_recursion_codes))
         return best_class
 
+    def preference_order(self, candidates):
+        """Returns the positions of candidates in the order of preference of
+        their classes, see choose_class().
+
+        Parameters:
+        candidates: list of tuples whose first item is a class code
+        """
+        return sorted(range(len(candidates)), key = lambda k:
+            self.class_preference.get(candidates[k][0], candidates[k][0]))
+
+    def similarity_bound(self, similarity, jaccard, len_algo, len_student):
+        """Upper bound of the similarity of a candidate and student's
+        sequence from their lengths.
+
+        Parameters:
+        similarity: 'states' or 'lcs', see match()
+        jaccard: True if the similarity is Jaccard similarity coefficient
+        len_algo, len_student: lengths of the candidate and student's
+            sequences
+
+        Returns:
+        bound for state_similarity() or lcs_similarity(), or for its Jaccard
+        similarity coefficient
+        """
+        if similarity == 'states':
+            # The index of a state in student's sequence + 1
+            bound = len_student
+        else:
+            bound = min(len_algo, len_student)
+        if jaccard:
+            # Increases with the similarity
+            bound /= (len_algo + len_student - bound)
+        return bound
+
 
     def loop_hypothesis_match(self, recording, options = {'similarity': 'states',
-        'Jaccard': False, 'threshold': 0, 'verbosity': 0}, debug_text = []):
+        'Jaccard': False, 'threshold': 0, 'verbosity': 0}, debug_text = [],
+        submission_id = None):
         """The same as replicated_study_match, but with main loop variant
         hypothesis.
 
@@ -378,50 +648,66 @@ class BuildHeapMatcher:
                    x is a value in an array storing the binary heap.
             'style': string, ignored
             'classes': string, ignored
+            Alternatively, a tuple (input, states, swaps) returned by
+            parse_recording().
+        submission_id: identifier of the submission, or None. See
+            parsed_recording().
         """
 
-        input, states, swaps = self.parse_recording(recording)
+        input, states, swaps = self.parsed_recording(recording, submission_id)
+        (hashes, index) = self.student_index(input, states)
 
         best_similarity = 0 # The initial state will always match
         best_classes = [0]  # The "unknown" class
         algo_score = {}
         algo_perfect_match = []
 
-        for loop in self.loop_variants:
-            for algo in self.heapify_algorithms:
-                class_code = loop[0] + algo[0]
-
-                algo_states, algo_swaps = self.build_heap_variant(loop[2],
-                    algo[2], input)
-
-                score = 0
-                len_algo = 0.1
-                len_states = 0.1
-                if (algo[1] == 'Delayed recursion'):
-                    score = 1 + self.lcs_similarity_delayed_recursion(algo_swaps,
-                                                                  swaps)
+        candidates = [(loop[0] + algo[0], loop, algo)
+            for loop in self.loop_variants_for(len(input))
+            for algo in self.heapify_algorithms]
+
+        # The candidates are evaluated in the order of class preference. The
+        # scores of candidates which cannot reach best_similarity are not
+        # computed, but each candidate is checked for a perfect match.
+        for position in self.preference_order(candidates):
+            (class_code, loop, algo) = candidates[position]
+
+            algo_states, algo_swaps = self.build_heap_variant(loop[2],
+                algo[2], input)
+            if self.same_states(algo_states, states, hashes):
+                algo_perfect_match.append(class_code)
+
+            score = 0
+            if (algo[1] == 'Delayed recursion'):
+                score = 1 + self.lcs_similarity_delayed_recursion(algo_swaps,
+                                                              swaps)
+            else:
+                if options['similarity'] == 'states':
+                    len_algo = len(algo_states)
+                    len_states = len(states)
+                elif options['similarity'] == 'lcs':
+                    len_algo = len(algo_swaps)
+                    len_states = len(swaps)
                 else:
-                    if options['similarity'] == 'states':
-                        score = self.state_similarity(algo_states, states)
-                        len_algo = len(algo_states)
-                        len_states = len(states)
-                    elif options['similarity'] == 'lcs':
-                        score = self.lcs_similarity(algo_swaps, swaps)
-                        len_algo = len(algo_swaps)
-                        len_states = len(swaps)
-                    else:
-                        raise Exception(
-                            "Similarity algorithm '{}' not implemented"
-                            .format(options['similarity']))
-
-                algo_score[class_code] = score
-                if (algo_states == states):
-                    algo_perfect_match.append(class_code)
-                if (score > best_similarity):
-                    best_classes = [class_code]
-                    best_similarity = score
-                elif (score == best_similarity):
-                    best_classes.append(class_code)
+                    raise Exception(
+                        "Similarity algorithm '{}' not implemented"
+                        .format(options['similarity']))
+
+                if self.similarity_bound(options['similarity'], False,
+                    len_algo, len_states) < best_similarity:
+                    continue
+                elif options['similarity'] == 'states':
+                    score = self.state_similarity(algo_states, states,
+                        algo_states.hashes, hashes, index)
+                else:
+                    score = self.lcs_similarity(algo_swaps, swaps)
+
+            algo_score[class_code] = score
+            if (score > best_similarity):
+                best_classes = [class_code]
+                best_similarity = score
+            elif (score == best_similarity):
+                best_classes.append(class_code)
 
         # Classify sequence
 
@@ -459,8 +745,8 @@ class BuildHeapMatcher:
             # No-Swaps
             return 10
 
-        algo_states, algo_swaps = self.build_heap_variant((4, 3, 2, 1, 0),
-            self.min_heapify, input)
+        algo_states, algo_swaps = self.build_heap_variant(
+            self.loop_variants_for(len(input))[0][2], self.min_heapify, input)
         if self.correct_with_extra_steps(states, algo_states):
             # Extra-Steps-After-Correct
             return 11
@@ -485,7 +771,7 @@ class BuildHeapMatcher:
         return 0
 
 
-    def replicated_study_match(self, recording):
+    def replicated_study_match(self, recording, submission_id = None):
         """Matches a JSAV recording of build-heap exercise to known
         misconceived algorithms according to study: Ville Karavirta,
         Ari Korhonen, and Otto Seppälä. 2013. Misconceptions in Visual
@@ -498,31 +784,16 @@ class BuildHeapMatcher:
                    x is a value in an array storing the binary heap.
             'style': string, ignored
             'classes': string, ignored
+            Alternatively, a tuple (input, states, swaps) returned by
+            parse_recording().
+        submission_id: identifier of the submission, or None. See
+            parsed_recording().
         """
 
-        # Name, main loop, heapify algorithm.
-        # The order of algorithms in this list also describes a descending
-        # order of preference when multiple algorithms fit equally well into
-        # the student's sequence.
-        algo_variants = [
-            ('Correct',             (4,3,2,1,0), self.min_heapify),
-            ('Wrong-Duplicate',     (4,3,2,1,0), self.wrong_duplicate),
-            ('Heapify-with-Father', (4,3,2,1,0), self.heapify_with_father_lr),
-            ('Heapify-with-Father', (4,3,2,1,0),
-             self.heapify_with_father_lr_recursive),
-            ('Heapify-with-Father', (4,3,2,1,0), self.heapify_with_father_rl),
-            ('Heapify-with-Father', (4,3,2,1,0),
-             self.heapify_with_father_rl_recursive),
-            ('Left-to-Right',       (3,4,1,2,0), self.min_heapify),
-            ('No-Recursion',        (4,3,2,1,0), self.no_recursion),
-            ('Single-Skip',         None, None),
-            ('Top-Down',            (0,1,2,3,4), self.min_heapify),
-            ('Delayed-Recursion',   None,        None),
-            ('Smallest-Instantly-Up', (0,1,2,3,4), self.smallest_instantly_up),
-            ('Other',               (0,2,1,4,3), self.smallest_instantly_up),
-            ('Maximum-Heap',        (4,3,2,1,0), self.max_heapify),
-            ]
+        input, states, swaps = self.parsed_recording(recording, submission_id)
+        (hashes, index) = self.student_index(input, states)
 
+        algo_variants = self.replicated_study_variants(len(input))
         V = len(algo_variants)
         algo_score = [0] * V # index of last matching state
         algo_perfect_match = [False] * V
@@ -532,45 +803,45 @@ class BuildHeapMatcher:
         # Single-Skip: Min-Heapify with one missing state
         # Delayed-Recursion: two variants, specific matching algorithm
 
-        input, states, swaps = self.parse_recording(recording)
-
         for i in range(len(algo_variants)):
             (name, main_loop, heapify) = algo_variants[i]
             if (name == 'Single-Skip'):
                 # Single-Skips produces many candidate sequences. Store the
                 # similarity score of the best match.
-                algo_sequences = self.single_skips(input)
-                max_score = 0
-                for s in algo_sequences:
-                    score = self.state_similarity(algo_states, states)
-                    if score > max_score and not algo_perfect_match[i]:
-                        max_score = score
-                        algo_score[i] = score
-                        algo_perfect_match[i] = (algo_states == states)
-                        algo_swap_count[i] = len(s) - 1
+                (algo_score[i], algo_perfect_match[i], algo_swap_count[i]) = \
+                    self.single_skip_similarity(input, states, hashes, index)
 
             elif (name == 'Delayed-Recursion'):
                 dr1_swaps = self.build_min_heap_dr_level(input)
                 dr2_swaps = self.build_min_heap_dr_end(input)
-                dr1_states = self.states_from_swaps(input, dr1_swaps)
-                dr2_states = self.states_from_swaps(input, dr2_swaps)
-                score1 = self.state_similarity(dr1_states, states)
-                score2 = self.state_similarity(dr2_states, states)
+                ranks = self.rank_pattern(input)
+                dr1_states = LazyStates(input, dr1_swaps,
+                    self.zobrist.hash_sequence(ranks, dr1_swaps))
+                dr2_states = LazyStates(input, dr2_swaps,
+                    self.zobrist.hash_sequence(ranks, dr2_swaps))
+                score1 = self.state_similarity(dr1_states, states,
+                    dr1_states.hashes, hashes, index)
+                score2 = self.state_similarity(dr2_states, states,
+                    dr2_states.hashes, hashes, index)
                 if score1 > score2:
                     algo_score[i] = score1
                     algo_swap_count[i] = len(dr1_swaps)
-                    algo_perfect_match[i] = (dr1_states == states)
+                    algo_perfect_match[i] = self.same_states(dr1_states,
+                        states, hashes)
                 else:
                     algo_score[i] = score2
                     algo_swap_count[i] = len(dr2_swaps)
-                    algo_perfect_match[i] = (dr2_states == states)
+                    algo_perfect_match[i] = self.same_states(dr2_states,
+                        states, hashes)
 
             else:
                 algo_states, algo_swaps = self.build_heap_variant(main_loop,
                     heapify, input)
-                algo_score[i] = self.state_similarity(algo_states, states)
+                algo_score[i] = self.state_similarity(algo_states, states,
+                    algo_states.hashes, hashes, index)
                 algo_swap_count[i] = len(algo_swaps)
-                algo_perfect_match[i] = (algo_states == states)
+                algo_perfect_match[i] = self.same_states(algo_states, states,
+                    hashes)
 
         self.statistics['total-matched'] += 1
 
@@ -614,13 +885,47 @@ class BuildHeapMatcher:
         # D: None of the rules apply.
         return ('Unknown', 'Unfinished')
 
+    def replicated_study_variants(self, N):
+        """Algorithm variants of replicated_study_match() for heap size N.
+
+        Returns:
+        list of (name, main loop, heapify algorithm). The order of algorithms
+        in this list also describes a descending order of preference when
+        multiple algorithms fit equally well into the student's sequence.
+        """
+        loops = self.loop_variants_for(N)
+        correct = loops[0][2]     # (4,3,2,1,0) for N = 10
+        level_lr = loops[3][2]    # (3,4,1,2,0)
+        top_down = loops[4][2]    # (0,1,2,3,4)
+        top_down_rl = loops[6][2] # (0,2,1,4,3)
+        return [
+            ('Correct',             correct, self.min_heapify),
+            ('Wrong-Duplicate',     correct, self.wrong_duplicate),
+            ('Heapify-with-Father', correct, self.heapify_with_father_lr),
+            ('Heapify-with-Father', correct,
+             self.heapify_with_father_lr_recursive),
+            ('Heapify-with-Father', correct, self.heapify_with_father_rl),
+            ('Heapify-with-Father', correct,
+             self.heapify_with_father_rl_recursive),
+            ('Left-to-Right',       level_lr, self.min_heapify),
+            ('No-Recursion',        correct, self.no_recursion),
+            ('Single-Skip',         None, None),
+            ('Top-Down',            top_down, self.min_heapify),
+            ('Delayed-Recursion',   None,        None),
+            ('Smallest-Instantly-Up', top_down, self.smallest_instantly_up),
+            ('Other',               top_down_rl, self.smallest_instantly_up),
+            ('Maximum-Heap',        correct, self.max_heapify),
+            ]
+
     def __record_ambiguous_matches(self, equal_candidates):
 
+        cross = self.statistics['cross-match']
+        V = int(round(len(cross) ** 0.5))
         for i in range(len(equal_candidates)):
             x = equal_candidates[i]
             for j in range(i + 1, len(equal_candidates)):
                 y = equal_candidates[j]
-                self.statistics['cross-match'][y * 13 + x] += 1
+                cross[y * V + x] += 1
 
     def print_statistics(self):
         print()
@@ -636,8 +941,11 @@ class BuildHeapMatcher:
         print("Misconception passes as correct; {}".format(pass_correct))
         print("Incorrect, equal misconceptions: {}".format(multi_misc))
         print("Matrix of cross-matches:")
-        for i in range(13):
-            print(cross[i * 13 : (i+1) * 13])
+        V = int(round(len(cross) ** 0.5))
+        for i in range(V):
+            print(cross[i * V : (i+1) * V])
+        print("Candidate cache hits / misses:   {} / {}".format(
+            self.candidate_cache.hits, self.candidate_cache.misses))
 
 
     def build_heap_variant(self, main_loop, heapify, input):
@@ -650,25 +958,51 @@ class BuildHeapMatcher:
         input:     input array
 
         Returns:
-        (states, swaps): states is a list containing the state of the heap
-                         array after each swap.
-                         swaps is similar to states but only has the index pair
-                         of each swap.
+        (states, swaps): states is a sequence containing the state of the
+                         heap array after each swap, see LazyStates. The
+                         tuples are constructed only when accessed. The
+                         hashes of the states are in states.hashes, see
+                         state_hashes().
+                         swaps is a list of the index pair of each swap. It
+                         is shared through self.candidate_cache and must not
+                         be modified.
         """
-        current_state = copy.copy(input)
-        states = [tuple(input)]
-        swaps = []
-        for i in main_loop:
-            heapify(current_state, i, states, swaps)
-
-        return (states, swaps)
+        # All heapify variants only compare keys, so the candidate depends
+        # only on the ranks of the input values. Equal values get equal ranks
+        # for Wrong-duplicate. Inputs with the same rank pattern share the
+        # swaps, which are simulated on the ranks without storing states.
+        # The hashes of the states are computed from the ranks, too.
+        ranks = self.rank_pattern(input)
+        key = (ranks, tuple(main_loop), heapify.__name__)
+        candidate = self.candidate_cache.get(key)
+        if candidate is None:
+            swaps = []
+            A = list(ranks)
+            for i in main_loop:
+                heapify(A, i, None, swaps)
+            candidate = (swaps, self.zobrist.hash_sequence(ranks, swaps))
+            self.candidate_cache.put(key, candidate)
+
+        (swaps, hashes) = candidate
+        return (LazyStates(input, swaps, hashes), swaps)
+
+    def rank_pattern(self, input):
+        """Returns the input with each value replaced by its rank among the
+        distinct values: a tuple of integers 0, 1, ..., k - 1."""
+        input_key = tuple(input)
+        if self.input_ranks[0] != input_key:
+            values = sorted(set(input))
+            rank = {values[r]: r for r in range(len(values))}
+            self.input_ranks = (input_key, tuple([rank[x] for x in input]))
+        return self.input_ranks[1]
 
 
     #
     # Matching algorithms
     #
 
-    def state_similarity(self, C, S):
+    def state_similarity(self, C, S, C_hashes = None, S_hashes = None,
+        S_index = None):
         """Finds furthest matching state of candidate sequence in student's
         sequence.
 
@@ -680,9 +1014,21 @@ class BuildHeapMatcher:
         Parameters:
         C (list): candidate sequence produced by an algorithm
         S (list): student's sequence
+        C_hashes, S_hashes: optional lists of hashes of the states in C and S,
+                  see state_hashes(). If given, the hashes are compared
+                  first, and the states only if their hashes are equal.
+        S_index:  optional index of S_hashes, see student_index(). If given
+                  with C_hashes, the matching states are found by binary
+                  search.
 
         Returns: index of last matching state in student's sequence + 1.
         """
+        if C_hashes is not None and S_index is not None:
+            return self.state_similarity_indexed(C, S, C_hashes, S_index)
+        if C_hashes is not None and S_hashes is not None:
+            return self.state_similarity_hashed(C, S, C_hashes, S_hashes)
+        if isinstance(C, LazyStates):
+            C = C.list()
 
         i = 0   # test index in candidate sequence
         j = 0   # test index in student's sequence
@@ -700,6 +1046,255 @@ class BuildHeapMatcher:
             i += 1
         return j
 
+    def state_similarity_hashed(self, C, S, C_hashes, S_hashes):
+        """Same as state_similarity(), but searches for the hashes of the
+        states. Two different states of the same input have equal 64-bit
+        hashes only rarely, so the states are compared only where the
+        hashes are equal.
+        """
+        same = self.state_comparison(C)
+        j = 0
+        for i in range(len(C_hashes)):
+            h = C_hashes[i]
+            k = j
+            while True:
+                try:
+                    k = S_hashes.index(h, k)
+                except ValueError:
+                    break
+                if same(i, S[k]):
+                    j = k + 1
+                    break
+                k += 1 # hash collision
+        return j
+
+    def state_similarity_indexed(self, C, S, C_hashes, S_index):
+        """Same as state_similarity_hashed(), but finds the next position of
+        each hash in the student's sequence from S_index by binary search:
+        O(|C| log |S|) instead of O(|C| |S|)."""
+        same = self.state_comparison(C)
+        j = 0
+        for i in range(len(C_hashes)):
+            positions = S_index.get(C_hashes[i])
+            if positions is not None:
+                for k in range(bisect.bisect_left(positions, j),
+                    len(positions)):
+                    if same(i, S[positions[k]]):
+                        j = positions[k] + 1
+                        break
+        return j
+
+    def state_similarity_prefixes(self, C, S, C_hashes, S_index):
+        """Same as state_similarity_indexed(), but yields the index in S
+        after matching each state of C."""
+        same = self.state_comparison(C)
+        j = 0
+        for i in range(len(C_hashes)):
+            positions = S_index.get(C_hashes[i])
+            if positions is not None:
+                for k in range(bisect.bisect_left(positions, j),
+                    len(positions)):
+                    if same(i, S[positions[k]]):
+                        j = positions[k] + 1
+                        break
+            yield j
+
+    def single_skip_similarity(self, input, S, S_hashes, S_index):
+        """Finds the Single-Skip candidate, see single_skips(), which matches
+        furthest in student's sequence S, like state_similarity().
+
+        The states of a candidate up to the omitted swap are those of the
+        correct variant, so they are matched only once. The later states are
+        compared only where their hashes are in S_hashes.
+
+        Parameters:
+        input: initial state of the heap array
+        S, S_hashes, S_index: student's sequence, its hashes and their index,
+                              see student_index()
+
+        Returns: (score, perfect, swap_count): score is the result of
+        state_similarity() for the best candidate, perfect is True if the
+        candidate is equal to S, and swap_count is its number of swaps.
+        """
+        variant = self.loop_variants_for(len(input))[0]
+        (correct, correct_swaps) = self.build_heap_variant(variant[2],
+            self.min_heapify, input)
+        prefixes = list(self.state_similarity_prefixes(correct, S,
+            correct.hashes, S_index))
+        if numpy is not None:
+            # Filter of the hashes of S by their lowest bits. Few hashes of
+            # other states pass it.
+            bits = max(20, (8 * len(S_hashes)).bit_length())
+            low_bits = numpy.uint64((1 << bits) - 1)
+            in_S = numpy.zeros(1 << bits, dtype = bool)
+            in_S[numpy.array(S_hashes, dtype = numpy.uint64) & low_bits] = \
+                True
+
+        (max_score, perfect, swap_count) = (0, False, 0)
+        for (i, swaps, hashes, suffix) in self.single_skip_hashes(input):
+            if numpy is not None:
+                found = numpy.flatnonzero(in_S[suffix & low_bits]).tolist()
+            else:
+                found = [t for t in range(len(suffix)) if suffix[t] in S_index]
+            j = prefixes[i]
+            C = None
+            for t in found:
+                positions = S_index.get(int(suffix[t]), [])
+                for k in range(bisect.bisect_left(positions, j),
+                    len(positions)):
+                    if C is None:
+                        C = LazyStates(input, swaps)
+                    if C.equals(i + 1 + t, S[positions[k]]):
+                        j = positions[k] + 1
+                        break
+            if j > max_score:
+                (max_score, swap_count) = (j, len(swaps))
+                if len(swaps) + 1 == len(S):
+                    if numpy is not None:
+                        suffix = suffix.tolist()
+                    C = LazyStates(input, swaps, hashes[0 : i + 1] + suffix)
+                    perfect = self.same_states(C, S, S_hashes)
+                    if perfect:
+                        break
+        return (max_score, perfect, swap_count)
+
+    def state_comparison(self, C):
+        """Returns a function (i, state) -> C[i] == state. For LazyStates,
+        it is LazyStates.equals()."""
+        if isinstance(C, LazyStates):
+            return C.equals
+        return lambda i, state: C[i] == state
+
+    def student_index(self, input, states):
+        """Returns the hashes of student's states and an index of them.
+        Both are computed once for a submission, and shared by its
+        candidates and by match(), loop_hypothesis_match() and
+        replicated_study_match(): they are memoised for the latest input and
+        states.
+
+        Returns:
+        (hashes, index): hashes is the list of hashes of the states, see
+            state_hashes(). index is a dict: hash -> sorted list of the
+            positions of the hash in hashes.
+        """
+        (memo_input, memo_states, hashes, index) = self.student_states
+        if memo_states != states or memo_input != input:
+            hashes = self.state_hashes(input, states)
+            index = {}
+            for k in range(len(hashes)):
+                index.setdefault(hashes[k], []).append(k)
+            self.student_states = (list(input), list(states), hashes, index)
+        return (hashes, index)
+
+    def state_hashes(self, input, states):
+        """Computes Zobrist hashes of states, see ZobristHasher.
+
+        The states are hashed by the ranks of their values in input, like the
+        candidates of build_heap_variant(), so that the hashes of candidates
+        can be shared by inputs with the same rank pattern. Equal hashes of
+        states of the same input mean equal states with high probability.
+
+        Parameters:
+        input: initial state of the heap array
+        states: list of states, usually permutations of input
+
+        Returns:
+        list of hashes, one for each state
+        """
+        values = sorted(set(input))
+        rank = {values[r]: r for r in range(len(values))}
+        # Values which are not in the input share one rank. Such states do
+        # not match any candidate.
+        other = len(values)
+        zobrist = self.zobrist
+        hashes = []
+        previous = None
+        for A in states:
+            if (previous is None or len(A) <= zobrist.table_size or
+                len(A) != len(previous)):
+                h = zobrist.hash_state([rank.get(x, other) for x in A])
+            else:
+                # Large heap: update the hash of the previous state, which
+                # usually differs by one swap
+                h = hashes[-1]
+                for i in self.changed_positions(previous, A):
+                    h ^= zobrist.key(i, rank.get(previous[i], other)) ^ \
+                        zobrist.key(i, rank.get(A[i], other))
+            hashes.append(h)
+            previous = A
+        return hashes
+
+    def changed_positions(self, A, B):
+        """Returns the indices where sequences A and B of equal length
+        differ. They are compared in blocks, so that the equal blocks are
+        skipped without a loop over their elements."""
+        positions = []
+        if A != B:
+            for start in range(0, len(A), 64):
+                end = start + 64
+                if A[start : end] != B[start : end]:
+                    positions += [i for i in range(start, min(end, len(A)))
+                        if A[i] != B[i]]
+        return positions
+
+    def state_distances(self, input, states, candidates):
+        """Hamming distances between student's states and the states of
+        all candidates of the input: the number of array positions where two
+        states differ. Each distinct candidate state is compared once, so the
+        matrix is shared by all candidates. It is memoised for the latest
+        input and states.
+
+        Parameters:
+        input: initial state of the heap array
+        states: student's states
+        candidates: list of the states of the candidates, see
+            build_heap_variant()
+
+        Returns:
+        (columns, distances): columns is a dict: hash of a candidate state ->
+            column of the state in distances. distances is a NumPy array
+            where distances[j][c] is the distance between states[j] and the
+            candidate state of column c.
+        """
+        (memo_input, memo_states, columns, distances) = self.student_distances
+        if memo_states == states and memo_input == input:
+            return (columns, distances)
+
+        # Union of candidate states by hash
+        columns = {}
+        union = []
+        for C in candidates:
+            for k in range(len(C)):
+                if C.hashes[k] not in columns:
+                    columns[C.hashes[k]] = len(union)
+                    union.append(C[k])
+
+        U = numpy.array(union)
+        distances = numpy.empty((len(states), len(union)), dtype = numpy.int32)
+        for j in range(len(states)):
+            distances[j] = (U != numpy.array(states[j])).sum(axis = 1)
+        self.student_distances = (list(input), list(states), columns,
+            distances)
+        return (columns, distances)
+
+    def dtw_similarity(self, C_hashes, columns, distances):
+        """DTW similarity of a candidate and student's states: 1 / (1 + d),
+        where d is the DTW distance of the sequences with Hamming distance
+        between states.
+
+        Parameters:
+        C_hashes: hashes of the candidate states
+        columns, distances: see state_distances()
+        """
+        D = distances[:, [columns[h] for h in C_hashes]]
+        return 1 / (1 + dtw_distances(D))
+
+    def same_states(self, C, S, S_hashes):
+        """Tests whether candidate states C, returned by build_heap_variant(),
+        are equal to student's states S with hashes S_hashes. The states are
+        compared only if all hashes are equal."""
+        return len(C) == len(S) and C.hashes == S_hashes and C == S
+
     def state_similarity_dr(self, input, C_swaps, S_swaps, heap_size):
         """Version of state_similarity() to detect delayed recursion where
         recursive swaps are performed after each level of the heap.
@@ -768,19 +1363,238 @@ class BuildHeapMatcher:
 
     def lcs_similarity(self, X, Y):
         """Length of longest common subsequence for sequences X and Y.
-        Dynamic programming solution."""
-        sim, matches = self.lcs(X, Y)
-        return sim
+        Bit-parallel solution, see lcs_length(), or if self.banded_lcs is
+        True, see lcs_length_banded()."""
+        if self.banded_lcs:
+            return self.lcs_length_banded(X, Y)
+        return self.lcs_length(X, Y)
+
+    def lcs_length_banded(self, X, Y):
+        """Length of longest common subsequence for sequences X and Y,
+        computing only a diagonal band of the LCS table.
+
+        With X the shorter sequence of length m and Y of length n, the band
+        follows the diagonal from (0, 0) to (m, n): row i consists of the
+        cells (i, j) where i * n / m - w <= j <= (i + 1) * n / m + w. The width
+        starts from w = lcs_band * m and is doubled while the alignment found
+        passes through the edge of the band. The result is exact if a longest
+        common subsequence lies inside the band; otherwise it is the length
+        of some shorter common subsequence. A band costs O(n + w * m) time
+        instead of the O(m * n) of the full table.
+
+        Returns:
+        length of common subsequence
+        """
+        if len(X) > len(Y):
+            (X, Y) = (Y, X)
+        if len(X) == 0:
+            return 0
+        w = max(1, int(self.lcs_band * len(X)))
+        while True:
+            (L, edge) = self.lcs_band_length(X, Y, w)
+            if not edge or w >= len(Y):
+                return L
+            w *= 2
+
+    def lcs_band_length(self, X, Y, w):
+        """Length of a common subsequence for sequences X and Y, len(X) <=
+        len(Y), which is the longest one inside the band of
+        lcs_length_banded() with width w.
+
+        Only one row of the table is kept. The cells left of the band keep
+        their values from earlier rows, and the cells right of it get the
+        value of its last cell. These are lengths of common subsequences, too.
+
+        Returns:
+        (length, edge): edge is True if the alignment passes through the
+        first or last cell of a row of the band, except in the first and last
+        column of the table. Of equally long alignments, one which avoids the
+        edge is preferred.
+        """
+        m = len(X)
+        n = len(Y)
+        row = [0] * (n + 1)
+        edges = [False] * (n + 1)
+        for i in range(1, m + 1):
+            x = X[i - 1]
+            first = max(1, i * n // m - w)
+            last = min(n, (i + 1) * n // m + w)
+            diagonal = row[first - 1]        # c[i - 1][j - 1]
+            diagonal_edge = edges[first - 1]
+            left = diagonal                  # c[i][j - 1]
+            left_edge = diagonal_edge
+            for j in range(first, last + 1):
+                up = row[j]
+                up_edge = edges[j]
+                if x == Y[j - 1]:
+                    # The match is at least as long as the other ways
+                    left_edge = diagonal_edge and not (
+                        up == diagonal + 1 and not up_edge or
+                        left == diagonal + 1 and not left_edge)
+                    left = diagonal + 1
+                elif up > left or (up == left and left_edge and not up_edge):
+                    left = up
+                    left_edge = up_edge
+                if (j == first and j > 1) or (j == last and j < n):
+                    left_edge = True
+                diagonal = up
+                diagonal_edge = up_edge
+                row[j] = left
+                edges[j] = left_edge
+
+            # The cells right of the band get the value of its last cell
+            end = min(n, (i + 2) * n // m + w)
+            row[last + 1 : end + 1] = [left] * (end - last)
+            edges[last + 1 : end + 1] = [left_edge] * (end - last)
+        return (row[n], edges[n])
+
+    def lcs_masks(self, Y):
+        """Match masks of sequence Y for lcs_length(): a dict where bit j of
+        the mask of x is set if Y[j] == x."""
+        masks = {}
+        for j in range(len(Y)):
+            masks[Y[j]] = masks.get(Y[j], 0) | (1 << j)
+        return masks
+
+    def lcs_length(self, X, Y, masks = None):
+        """Length of longest common subsequence for sequences X and Y,
+        computed without the dynamic programming table.
+
+        Each row of the table is represented by bit vector V, a Python
+        integer of len(Y) bits: bit j is 0 if the row grows by one at column
+        j + 1. The row of each element of X is computed from the previous one
+        with a few integer operations on all bits at once, O(len(X) *
+        len(Y) / w) word operations in total.
+
+        According to: Heikki Hyyrö (2004) Bit-parallel LCS-length
+        computation revisited. Proc. 15th Australasian Workshop on
+        Combinatorial Algorithms (AWOCA 2004), 16-27.
+
+        Parameters:
+        X, Y: sequences of hashable elements, such as swaps
+        masks: lcs_masks(Y), or None to compute them
+
+        Returns:
+        length of longest common subsequence
+        """
+        if masks is None:
+            masks = self.lcs_masks(Y)
+        ones = (1 << len(Y)) - 1
+        V = ones
+        for x in X:
+            M = masks.get(x, 0)
+            U = V & M
+            V = ((V + U) | (V - U)) & ones
+        return len(Y) - bin(V).count('1')
 
     def lcs(self, X, Y):
-        """Longest common subsequence for sequences X and Y.
-        Dynamic programming solution.
+        """Longest common subsequence for sequences X and Y. If few pairs of
+        elements of X and Y match, solved with lcs_hunt_szymanski();
+        otherwise with lcs_hirschberg(), which uses linear memory. Both
+        return the same result as lcs_table().
 
         Returns:
         (sim, matches): sim is length of longest common subsequence.
                         matches is a list of tuples (a, b): each tuple indicates
                         a matching character; X[a] == Y[b]
         """
+        positions = self.lcs_positions(Y)
+        r = 0 # number of matching pairs
+        for x in X:
+            if x in positions:
+                r += len(positions[x])
+        if r <= self.lcs_sparse_density * len(X) * len(Y):
+            return self.lcs_hunt_szymanski(X, Y, positions)
+        return self.lcs_hirschberg(X, Y)
+
+    def lcs_positions(self, Y):
+        """Returns a dict: element of Y -> list of its positions in Y + 1 in
+        descending order."""
+        positions = {}
+        for j in range(len(Y), 0, -1):
+            positions.setdefault(Y[j - 1], []).append(j)
+        return positions
+
+    def lcs_hunt_szymanski(self, X, Y, positions = None):
+        """Longest common subsequence for sequences X and Y in O((r + m + n)
+        log n) time, where r is the number of matching pairs of elements of X
+        and Y, m = len(X) and n = len(Y). Fast when r is much less than m * n.
+
+        According to: James W. Hunt and Thomas G. Szymanski (1977) A fast
+        algorithm for computing longest common subsequences. Communications
+        of the ACM 20(5), 350-353.
+
+        Each row i of the LCS table is represented by thresholds T: T[k] is
+        the first column j where c[i][j] == k + 1, so c[i][j] is the number of
+        thresholds <= j. Only matching pairs change the thresholds. The
+        changes of each row are logged, so that the rows can be restored in
+        reverse order to backtrack the same matches as lcs_table(): where X[i
+        - 1] != Y[j - 1], lcs_table() steps up exactly when c[i - 1][j] ==
+        c[i][j], and c[i][j] only changes at matches.
+
+        Parameters:
+        positions: lcs_positions(Y), or None to compute them
+
+        Returns:
+        (sim, matches), see lcs()
+        """
+        if positions is None:
+            positions = self.lcs_positions(Y)
+        m = len(X)
+        T = []
+        # changes[i]: list of (k, previous T[k] or None if appended) of row i
+        changes = [None] * (m + 1)
+        for i in range(1, m + 1):
+            row_changes = []
+            for j in positions.get(X[i - 1], ()):
+                k = bisect.bisect_left(T, j)
+                if k == len(T):
+                    T.append(j)
+                    row_changes.append((k, None))
+                elif T[k] > j:
+                    row_changes.append((k, T[k]))
+                    T[k] = j
+            changes[i] = row_changes
+
+        def restore(i):
+            """Changes T from row i to row i - 1."""
+            for (k, previous) in reversed(changes[i]):
+                if previous is None:
+                    T.pop()
+                else:
+                    T[k] = previous
+
+        sim = len(T)
+        matches = []
+        i = m
+        j = len(Y)
+        v = sim # c[i][j]
+        if i > 0:
+            restore(i) # T is row i - 1
+        while (i > 0 and j > 0):
+            if X[i - 1] == Y[j - 1]:
+                matches.append((i - 1, j - 1))
+                i -= 1
+                j -= 1
+                v -= 1
+                if i > 0:
+                    restore(i)
+            elif bisect.bisect_right(T, j) == v:
+                i -= 1
+                if i > 0:
+                    restore(i)
+            else:
+                j -= 1
+        matches.reverse()
+        return (sim, matches)
+
+    def lcs_table(self, X, Y):
+        """Longest common subsequence for sequences X and Y.
+        Dynamic programming solution with the full table.
+
+        Returns:
+        (sim, matches), see lcs()
+        """
 
         # Adapted from:
         # Cormen, Leiserson, Rivest, Stein: Introduction to Algorithms (3rd ed.).
@@ -788,11 +1602,11 @@ class BuildHeapMatcher:
 
         m = len(X)
         n = len(Y)
-        c = []
-        b = []
-        for i in range(m + 1):
-            c.append([0] * (n + 1))
-            b.append([0] * (n + 1))
+        w = n + 1
+        # Tables of (m + 1) rows and n + 1 columns, row by row: cell (i, j)
+        # is at index i * w + j.
+        c = array.array('i', bytes(4 * (m + 1) * w))
+        b = array.array('b', bytes((m + 1) * w))
 
         # c[i][j] will hold the length of longest common subsequence for substrings
         # X_i and Y_j: X_i is the first i characters of X, and Y_j is the first j
@@ -808,37 +1622,142 @@ class BuildHeapMatcher:
         # to compute the first actual results where either i or j is 1.
 
         for i in range(1, m + 1):
-            for j in range(1, n + 1):
-                if X[i - 1] == Y[j - 1]:
+            x = X[i - 1]
+            k = i * w     # cell (i, j - 1)
+            left = 0      # c[i][j - 1]
+            for y in Y:
+                k += 1
+                if x == y:
                     # If the characters match, grow the length by one from the
                     # upper-left cell
-                    c[i][j] = c[i - 1][j - 1] + 1
-                    b[i][j] = 1
+                    left = c[k - w - 1] + 1
+                    b[k] = 1
                 else:
                     # Choose the value of either upper or left cell, which one is
                     # greater.
-                    if c[i - 1][j] >= c[i][j - 1]:
-                        c[i][j] = c[i - 1][j]
-                        b[i][j] = 2
+                    up = c[k - w]
+                    if up >= left:
+                        left = up
+                        b[k] = 2
                     else:
-                        c[i][j] = c[i][j - 1]
-                        b[i][j] = 3
+                        b[k] = 3
+                c[k] = left
 
         # Construct sequence of matching indices in X and Y
         matches = []
         i = m
         j = n
         while (i > 0 and j > 0):
-            if (b[i][j] == 1):
+            if (b[i * w + j] == 1):
                 matches.append((i - 1, j - 1))
                 i -= 1
                 j -= 1
-            elif (b[i][j] == 2):
+            elif (b[i * w + j] == 2):
                 i -= 1
             else:
                 j -= 1
         matches.reverse()
-        return (c[m][n], matches)
+        return (c[m * w + n], matches)
+
+    def lcs_hirschberg(self, X, Y):
+        """Longest common subsequence for sequences X and Y in O(len(X) +
+        len(Y)) memory.
+
+        The matches are those of the backtracking of lcs_table(), which
+        prefers a match, then a step up in the table. Hirschberg's
+        divide-and-conquer is used to find them: the rows of the table are
+        halved, the row in the middle is computed keeping only two rows, and
+        the lower half is traced first to find the column where the path
+        enters the middle row. The path moves only left and up, so the upper
+        half is then solved for the columns up to that one. The time is
+        O(len(X) * len(Y) * log(len(X))) in the worst case.
+
+        Returns:
+        (sim, matches), see lcs()
+        """
+        matches = []
+        row = array.array('i', bytes(4 * (len(Y) + 1)))
+        self.lcs_trace(X, Y, 0, row, len(X), len(Y), matches)
+        matches.reverse()
+        return (len(matches), matches)
+
+    def lcs_rows(self, X, Y, top, row, bottom):
+        """Computes row bottom of the LCS table from row top.
+
+        Parameters:
+        top, bottom: row indices, top <= bottom
+        row: row top of the table as an array, for columns 0...len(row) - 1
+
+        Returns:
+        row bottom as an array of the same length
+        """
+        Y = Y[0 : len(row) - 1]
+        previous = array.array('i', row)
+        current = array.array('i', row)
+        for i in range(top + 1, bottom + 1):
+            x = X[i - 1]
+            left = 0
+            j = 0
+            for y in Y:
+                if x == y:
+                    left = previous[j] + 1
+                elif previous[j + 1] > left:
+                    left = previous[j + 1]
+                j += 1
+                current[j] = left
+            (previous, current) = (current, previous)
+        return previous
+
+    def lcs_trace(self, X, Y, top, row, bottom, j, matches):
+        """Traces the backtracking path of lcs_table() from cell (bottom, j)
+        until it reaches row top or column 0.
+
+        Parameters:
+        top, bottom: row indices, top <= bottom
+        row: row top of the LCS table as an array, for columns 0...j
+        matches: list to which the matches of the path are appended, the
+            last one first
+
+        Returns:
+        column where the path reaches row top, or 0
+        """
+        if (bottom - top <= 1 or
+            (bottom - top) * (j + 1) <= self.lcs_table_cells):
+            # Small enough: store the rows and walk the path.
+            rows = [row]
+            Y_j = Y[0 : j]
+            for i in range(top + 1, bottom + 1):
+                x = X[i - 1]
+                previous = rows[-1]
+                current = array.array('i', previous)
+                left = 0
+                k = 0
+                for y in Y_j:
+                    if x == y:
+                        left = previous[k] + 1
+                    elif previous[k + 1] > left:
+                        left = previous[k + 1]
+                    k += 1
+                    current[k] = left
+                rows.append(current)
+            i = bottom
+            while i > top and j > 0:
+                if X[i - 1] == Y[j - 1]:
+                    matches.append((i - 1, j - 1))
+                    i -= 1
+                    j -= 1
+                elif rows[i - 1 - top][j] >= rows[i - top][j - 1]:
+                    i -= 1
+                else:
+                    j -= 1
+            return j
+
+        middle = (top + bottom) // 2
+        middle_row = self.lcs_rows(X, Y, top, row, middle)
+        j = self.lcs_trace(X, Y, middle, middle_row, bottom, j, matches)
+        if j == 0:
+            return 0
+        return self.lcs_trace(X, Y, top, row[0 : j + 1], middle, j, matches)
 
     def states_from_swaps(self, input, swaps):
         """Constructs a sequence of states from sequence of swaps and an input.
@@ -977,11 +1896,33 @@ class BuildHeapMatcher:
         A (list of integers): the heap array, will be modified.
         i (integer):          an index in the heap array to begin.
         states (list of tuples): each time a swap is performed, a tuple copy
-                                 of A is stored here.
+                                 of A is stored here. If None, the states
+                                 are not stored.
         swaps (list of tuples): each time a swap is performed, a tuple
                                 indicating the swap indices is stored here:
                                 (i,j), where 0 <= i < j < len(A).
         """
+        if not self.iterative_kernels:
+            return self.min_heapify_rec(A, i, states, swaps)
+        n = len(A)
+        while True:
+            l = 2 * i + 1
+            r = l + 1
+            smallest = i
+            if l < n and A[l] < A[i]:
+                smallest = l
+            if r < n and A[r] < A[smallest]:
+                smallest = r
+            if smallest == i:
+                return
+            A[i], A[smallest] = A[smallest], A[i]
+            swaps.append((i, smallest))
+            if states is not None:
+                states.append(tuple(A))
+            i = smallest
+
+    def min_heapify_rec(self, A, i, states, swaps):
+        """Recursive implementation of min_heapify()."""
         l = 2 * i + 1
         r = l + 1
         smallest = i
@@ -992,8 +1933,9 @@ class BuildHeapMatcher:
         if smallest != i:
             A[i], A[smallest] = A[smallest], A[i]
             swaps.append((i, smallest))
-            states.append(tuple(A))
-            self.min_heapify(A, smallest, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.min_heapify_rec(A, smallest, states, swaps)
 
     def no_recursion(self, A, i, states, swaps):
         """Min-heapify without recursion.
@@ -1017,7 +1959,8 @@ class BuildHeapMatcher:
         if smallest != i:
             A[i], A[smallest] = A[smallest], A[i]
             swaps.append((i, smallest))
-            states.append(tuple(A))
+            if states is not None:
+                states.append(tuple(A))
 
     def delayed_recursion(self, A, i, states, swaps, first_instance = True):
         """Min-heapify for delayed recursion: *recursive* swaps where
@@ -1034,6 +1977,31 @@ class BuildHeapMatcher:
                                 (i,j, r), where 0 <= i < j < len(A) and
                                 r = True if swap is recursive, False otherwise.
         """
+        if not self.iterative_kernels:
+            return self.delayed_recursion_rec(A, i, states, swaps,
+                first_instance)
+        n = len(A)
+        recursive = not first_instance
+        while True:
+            l = 2 * i + 1
+            r = l + 1
+            smallest = i
+            if l < n and A[l] < A[i]:
+                smallest = l
+            if r < n and A[r] < A[smallest]:
+                smallest = r
+            if smallest == i:
+                return
+            A[i], A[smallest] = A[smallest], A[i]
+            swaps.append((i, smallest, recursive))
+            if states is not None:
+                states.append(tuple(A))
+            i = smallest
+            recursive = True
+
+    def delayed_recursion_rec(self, A, i, states, swaps,
+        first_instance = True):
+        """Recursive implementation of delayed_recursion()."""
         l = 2 * i + 1
         r = l + 1
         smallest = i
@@ -1044,8 +2012,9 @@ class BuildHeapMatcher:
         if smallest != i:
             A[i], A[smallest] = A[smallest], A[i]
             swaps.append((i, smallest, not first_instance))
-            states.append(tuple(A))
-            self.delayed_recursion(A, smallest, states, swaps, False)
+            if states is not None:
+                states.append(tuple(A))
+            self.delayed_recursion_rec(A, smallest, states, swaps, False)
 
     def build_min_heap_dr_level(self, input, show_recursivity = False):
         """Build-min-heap for delayed recursion: *recursive* swaps where
@@ -1078,9 +2047,8 @@ class BuildHeapMatcher:
         # Main loop of Build-heap (correct descending index version)
         for i in range(len(A) // 2 - 1, -1, -1):
             # Run min-heapify for index i
-            tmp_states = []
             tmp_swaps = []
-            self.delayed_recursion(A, i, tmp_states, tmp_swaps)
+            self.delayed_recursion(A, i, None, tmp_swaps)
 
             # Filter recursive swaps of Min-heapify into queue.
             for s in tmp_swaps:
@@ -1129,9 +2097,8 @@ class BuildHeapMatcher:
         # Main loop of Build-heap (correct descending index version)
         for i in range(len(A) // 2 - 1, -1, -1):
             # Run min-heapify for index i
-            tmp_states = []
             tmp_swaps = []
-            self.delayed_recursion(A, i, tmp_states, tmp_swaps)
+            self.delayed_recursion(A, i, None, tmp_swaps)
 
             # Filter recursive swaps of Min-heapify into queue.
             for s in tmp_swaps:
@@ -1154,39 +2121,121 @@ class BuildHeapMatcher:
         input: initial state of the heap array
 
         Returns:
-        a list where each element is a candidate sequence (sequence of states)
+        a generator of pairs (i, C), where C is the candidate sequence where
+        swap i is omitted: LazyStates with hashes, see build_heap_variant().
+        The states 0, ..., i of C are those of the correct variant.
+        """
+        for (i, swaps, hashes, suffix) in self.single_skip_hashes(input):
+            if numpy is not None:
+                suffix = suffix.tolist()
+            yield (i, LazyStates(input, swaps, hashes[0 : i + 1] + suffix))
+
+    def single_skip_hashes(self, input):
+        """Generates the candidates of single_skips() without constructing
+        their states.
+
+        The candidates are generated one at a time from the swaps and state
+        hashes of the correct variant. Omitting a swap and the recursive
+        swaps after it leaves a few elements in other positions than in the
+        correct variant. The later swaps are the same, so the hashes of the
+        later states differ from the correct ones only by the keys of these
+        elements, which change at the swaps that move them.
+
+        Parameters:
+        input: initial state of the heap array
+
+        Returns:
+        a generator of tuples (i, swaps, hashes, suffix) for the candidate
+        where swap i is omitted: swaps are its swaps, hashes are the hashes
+        of the states of the correct variant, the first i + 1 of which are
+        the candidate's, and suffix has the hashes of its later states, as a
+        NumPy array of uint64 if NumPy is available, otherwise as a list.
         """
 
         A = copy.copy(input) # heap array
-        states = []
         swaps = []
 
         # Run correct variant where recursive and nonrecursive swaps are
         # identified.
-        for i in range(4, -1, -1):
-            self.delayed_recursion(A, i, states, swaps)
+        for i in range(len(input) // 2 - 1, -1, -1):
+            self.delayed_recursion(A, i, None, swaps)
+
+        # The ranks and the elements (indices in input) swapped by each swap
+        # of the correct variant, and the swaps moving each element
+        ranks = self.rank_pattern(input)
+        A = list(ranks)
+        elements = list(range(len(A)))
+        swapped = []
+        moves = [[] for e in elements]
+        for t in range(len(swaps)):
+            (i, j) = swaps[t][0:2]
+            swapped.append((A[i], A[j], elements[i], elements[j]))
+            moves[elements[i]].append(t)
+            moves[elements[j]].append(t)
+            A[i], A[j] = A[j], A[i]
+            elements[i], elements[j] = elements[j], elements[i]
+        hashes = self.zobrist.hash_sequence(ranks, swaps)
+        if numpy is not None:
+            hash_array = numpy.array(hashes, dtype = numpy.uint64)
+        key = self.zobrist.key
 
         # Generate systematically variants where one swap is omitted.
-
-        all_sequences = []
         for i in range(len(swaps)):  # i is the omitted swap
-            A = copy.copy(input)
-            j = 0
-            sequence = [tuple(input)]
-            while (j < len(swaps)): # iterate through all swaps
-                if (i != j):
-                    self.swap(A, swaps[j])
-                    sequence.append(tuple(A))
-                    j += 1
-                else:
-                    j += 1 # skip current swap
-                    # terminate recursion
-                    while (j < len(swaps) and swaps[j][2] == True):
-                        j += 1
-            all_sequences.append(sequence)
+            # terminate recursion: swaps i, ..., k - 1 are omitted
+            k = i + 1
+            while (k < len(swaps) and swaps[k][2] == True):
+                k += 1
 
-        return all_sequences
+            # Ranks in the positions of the omitted swaps before them, and
+            # ranks and elements after them in the correct variant
+            before = {}
+            after = {}
+            for t in range(i, k):
+                (p, q) = swaps[t][0:2]
+                (a, b, e, f) = swapped[t]
+                before.setdefault(p, a)
+                before.setdefault(q, b)
+                after[p] = (b, f)
+                after[q] = (a, e)
+
+            # Ranks of the elements which are misplaced in the candidate.
+            # An element keeps its rank in the candidate when the later
+            # swaps move it.
+            misplaced = {}
+            for (p, (a, e)) in after.items():
+                if before[p] != a:
+                    misplaced[e] = before[p]
+
+            # The hash of a later state in the candidate is the hash in the
+            # correct variant ^ H[i] ^ H[k] ^ the exclusive or of changes,
+            # where the change of a swap moving misplaced elements is the
+            # difference of its keys in the candidate and the correct
+            # variant.
+            changes = {}
+            for e in misplaced:
+                for t in moves[e][bisect.bisect_left(moves[e], k):]:
+                    if t not in changes:
+                        (i1, j1) = swaps[t][0:2]
+                        (a, b, e1, f1) = swapped[t]
+                        a = misplaced.get(e1, a)
+                        b = misplaced.get(f1, b)
+                        changes[t] = hashes[t] ^ hashes[t + 1] ^ \
+                            key(i1, a) ^ key(j1, b) ^ key(i1, b) ^ key(j1, a)
+            delta = hashes[i] ^ hashes[k]
+            if numpy is not None:
+                suffix = numpy.zeros(len(swaps) - k, dtype = numpy.uint64)
+                for (t, change) in changes.items():
+                    suffix[t - k] = change
+                suffix[0:1] ^= numpy.uint64(delta)
+                suffix = hash_array[k + 1:] ^ \
+                    numpy.bitwise_xor.accumulate(suffix)
+            else:
+                suffix = []
+                for t in range(k, len(swaps)):
+                    delta ^= changes.get(t, 0)
+                    suffix.append(hashes[t + 1] ^ delta)
 
+            yield (i, swaps[0:i] + swaps[k:], hashes, suffix)
 
 
     def heapify_with_father_lr(self, A, i, states, swaps):
@@ -1197,29 +2246,67 @@ class BuildHeapMatcher:
         if l < len(A) and A[l] < A[i]:
             A[i], A[l] = A[l], A[i]
             swaps.append((i, l))
-            states.append(tuple(A))
+            if states is not None:
+                states.append(tuple(A))
 
         if r < len(A) and A[r] < A[i]:
             A[i], A[r] = A[r], A[i]
             swaps.append((i, r))
-            states.append(tuple(A))
+            if states is not None:
+                states.append(tuple(A))
 
     def heapify_with_father_lr_recursive(self, A, i, states, swaps):
         """Min-heapify: heapify-with-father, right child first, recursive"""
+        if not self.iterative_kernels:
+            return self.heapify_with_father_lr_recursive_rec(A, i, states,
+                swaps)
+        n = len(A)
+        # Nodes whose right child is compared after returning from the
+        # left one. Returning from the right child ends the call.
+        stack = []
+        compare_left = True
+        while True:
+            c = 2 * i + 1
+            if compare_left and c < n and A[c] < A[i]:
+                A[i], A[c] = A[c], A[i]
+                swaps.append((i, c))
+                if states is not None:
+                    states.append(tuple(A))
+                stack.append(i)
+                i = c
+                continue
+            c = 2 * i + 2
+            if c < n and A[c] < A[i]:
+                A[i], A[c] = A[c], A[i]
+                swaps.append((i, c))
+                if states is not None:
+                    states.append(tuple(A))
+                i = c
+                compare_left = True
+                continue
+            if not stack:
+                return
+            i = stack.pop()
+            compare_left = False
+
+    def heapify_with_father_lr_recursive_rec(self, A, i, states, swaps):
+        """Recursive implementation of heapify_with_father_lr_recursive()."""
         l = 2 * i + 1
         r = l + 1
 
         if l < len(A) and A[l] < A[i]:
             A[i], A[l] = A[l], A[i]
             swaps.append((i, l))
-            states.append(tuple(A))
-            self.heapify_with_father_lr_recursive(A, l, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.heapify_with_father_lr_recursive_rec(A, l, states, swaps)
 
         if r < len(A) and A[r] < A[i]:
             A[i], A[r] = A[r], A[i]
             swaps.append((i, r))
-            states.append(tuple(A))
-            self.heapify_with_father_lr_recursive(A, r, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.heapify_with_father_lr_recursive_rec(A, r, states, swaps)
 
     def heapify_with_father_rl(self, A, i, states, swaps):
         """Min-heapify: heapify-with-father, right child first"""
@@ -1228,32 +2315,91 @@ class BuildHeapMatcher:
         if r < len(A) and A[r] < A[i]:
             A[i], A[r] = A[r], A[i]
             swaps.append((i, r))
-            states.append(tuple(A))
+            if states is not None:
+                states.append(tuple(A))
 
         if l < len(A) and A[l] < A[i]:
             A[i], A[l] = A[l], A[i]
             swaps.append((i, l))
-            states.append(tuple(A))
+            if states is not None:
+                states.append(tuple(A))
 
     def heapify_with_father_rl_recursive(self, A, i, states, swaps):
         """Min-heapify: heapify-with-father, right child first, recursive"""
+        if not self.iterative_kernels:
+            return self.heapify_with_father_rl_recursive_rec(A, i, states,
+                swaps)
+        n = len(A)
+        # Nodes whose left child is compared after returning from the
+        # right one. Returning from the left child ends the call.
+        stack = []
+        compare_right = True
+        while True:
+            c = 2 * i + 2
+            if compare_right and c < n and A[c] < A[i]:
+                A[i], A[c] = A[c], A[i]
+                swaps.append((i, c))
+                if states is not None:
+                    states.append(tuple(A))
+                stack.append(i)
+                i = c
+                continue
+            c = 2 * i + 1
+            if c < n and A[c] < A[i]:
+                A[i], A[c] = A[c], A[i]
+                swaps.append((i, c))
+                if states is not None:
+                    states.append(tuple(A))
+                i = c
+                compare_right = True
+                continue
+            if not stack:
+                return
+            i = stack.pop()
+            compare_right = False
+
+    def heapify_with_father_rl_recursive_rec(self, A, i, states, swaps):
+        """Recursive implementation of heapify_with_father_rl_recursive()."""
         l = 2 * i + 1
         r = l + 1
         if r < len(A) and A[r] < A[i]:
             A[i], A[r] = A[r], A[i]
             swaps.append((i, r))
-            states.append(tuple(A))
-            self.heapify_with_father_rl_recursive(A, r, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.heapify_with_father_rl_recursive_rec(A, r, states, swaps)
 
         if l < len(A) and A[l] < A[i]:
             A[i], A[l] = A[l], A[i]
             swaps.append((i, l))
-            states.append(tuple(A))
-            self.heapify_with_father_rl_recursive(A, l, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.heapify_with_father_rl_recursive_rec(A, l, states, swaps)
 
 
     def heapify_up(self, A, i, states, swaps):
         """Min-heapify: swap upwards towards root"""
+        if not self.iterative_kernels:
+            return self.heapify_up_rec(A, i, states, swaps)
+        n = len(A)
+        while i >= 0:
+            l = 2 * i + 1
+            r = l + 1
+            smallest = i
+            if l < n and A[l] < A[i]:
+                smallest = l
+            if r < n and A[r] < A[smallest]:
+                smallest = r
+            if smallest == i:
+                return
+            A[i], A[smallest] = A[smallest], A[i]
+            swaps.append((i, smallest))
+            if states is not None:
+                states.append(tuple(A))
+            i = (i - 1) // 2
+
+    def heapify_up_rec(self, A, i, states, swaps):
+        """Recursive implementation of heapify_up()."""
         if (i < 0):
             return
         l = 2 * i + 1
@@ -1266,11 +2412,33 @@ class BuildHeapMatcher:
         if smallest != i:
             A[i], A[smallest] = A[smallest], A[i]
             swaps.append((i, smallest))
-            states.append(tuple(A))
-            self.heapify_up(A, (i - 1) // 2, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.heapify_up_rec(A, (i - 1) // 2, states, swaps)
 
     def max_heapify(self, A, i, states, swaps):
         """Max-heapify"""
+        if not self.iterative_kernels:
+            return self.max_heapify_rec(A, i, states, swaps)
+        n = len(A)
+        while True:
+            l = 2 * i + 1
+            r = l + 1
+            greatest = i
+            if l < n and A[l] > A[i]:
+                greatest = l
+            if r < n and A[r] > A[greatest]:
+                greatest = r
+            if greatest == i:
+                return
+            A[i], A[greatest] = A[greatest], A[i]
+            swaps.append((i, greatest))
+            if states is not None:
+                states.append(tuple(A))
+            i = greatest
+
+    def max_heapify_rec(self, A, i, states, swaps):
+        """Recursive implementation of max_heapify()."""
         l = 2 * i + 1
         r = l + 1
         greatest = i
@@ -1281,12 +2449,34 @@ class BuildHeapMatcher:
         if greatest != i:
             A[i], A[greatest] = A[greatest], A[i]
             swaps.append((i, greatest))
-            states.append(tuple(A))
-            self.max_heapify(A, greatest, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.max_heapify_rec(A, greatest, states, swaps)
 
     def wrong_duplicate(self, A, i, states, swaps):
         """Min-heapify: if both children are equal and father is greater than
         them, swap the right child with the father"""
+        if not self.iterative_kernels:
+            return self.wrong_duplicate_rec(A, i, states, swaps)
+        n = len(A)
+        while True:
+            l = 2 * i + 1
+            r = l + 1
+            smallest = i
+            if l < n and A[l] < A[i]:
+                smallest = l
+            if r < n and A[r] <= A[smallest]:
+                smallest = r
+            if smallest == i:
+                return
+            A[i], A[smallest] = A[smallest], A[i]
+            swaps.append((i, smallest))
+            if states is not None:
+                states.append(tuple(A))
+            i = smallest
+
+    def wrong_duplicate_rec(self, A, i, states, swaps):
+        """Recursive implementation of wrong_duplicate()."""
         l = 2 * i + 1
         r = l + 1
         smallest = i
@@ -1298,8 +2488,9 @@ class BuildHeapMatcher:
         if smallest != i:
             A[i], A[smallest] = A[smallest], A[i]
             swaps.append((i, smallest))
-            states.append(tuple(A))
-            self.wrong_duplicate(A, smallest, states, swaps)
+            if states is not None:
+                states.append(tuple(A))
+            self.wrong_duplicate_rec(A, smallest, states, swaps)
 
 
     def path_bubblesort(self, A, i, states, swaps):
@@ -1333,7 +2524,8 @@ class BuildHeapMatcher:
                 if (A[index1] < A[index2]):
                     A[index1], A[index2] = A[index2], A[index1]
                     swaps.append((index2, index1))
-                    states.append(tuple(A))
+                    if states is not None:
+                        states.append(tuple(A))
 
     def smallest_instantly_up(self, A, i, states, swaps):
         """Smallest-instantly-up: the tree is traversed in level order,
@@ -1342,17 +2534,49 @@ class BuildHeapMatcher:
 
         # This heapify variant might work only with the Top-down (the same as
         # levelorder) loop variant.
+        if len(A) >= self.subtree_minimum_size:
+            tree = self.subtree_minimum
+            if tree is None or tree.A is not A or len(tree.pre) != len(A):
+                tree = SubtreeMinimumTree(A)
+                self.subtree_minimum = tree
+            j = tree.minimum(i)
+            if (i != j):
+                tree.swap(i, j)
+                swaps.append((i, j))
+                if states is not None:
+                    states.append(tuple(A))
+            return
+
         min_value = max(A) + 1
         min_index = -1
         (min_value, j) = self.subtree_min_index(A, i, min_value, min_index)
         if (i != j):
             A[i], A[j] = A[j], A[i]
             swaps.append((i, j))
-            states.append(tuple(A))
+            if states is not None:
+                states.append(tuple(A))
 
     def subtree_min_index(self, A, i, min_value, min_index):
         """Searches for the minimum value in the subtree rooted at node
         with index i. Returns the index of the minimum value."""
+        if not self.iterative_kernels:
+            return self.subtree_min_index_rec(A, i, min_value, min_index)
+        n = len(A)
+
+        # Traverse in preorder
+        stack = [i]
+        while stack:
+            i = stack.pop()
+            if i < n:
+                if (A[i] < min_value):
+                    min_value = A[i]
+                    min_index = i
+                stack.append(2 * i + 2)
+                stack.append(2 * i + 1)
+        return (min_value, min_index)
+
+    def subtree_min_index_rec(self, A, i, min_value, min_index):
+        """Recursive implementation of subtree_min_index()."""
         if (i >= len(A)):
             return (min_value, min_index)
 
@@ -1360,9 +2584,9 @@ class BuildHeapMatcher:
         if (A[i] < min_value):
             min_value = A[i]
             min_index = i
-        (min_value, min_index) = self.subtree_min_index(A, 2 * i + 1,
+        (min_value, min_index) = self.subtree_min_index_rec(A, 2 * i + 1,
             min_value, min_index)
-        (min_value, min_index) = self.subtree_min_index(A, 2 * i + 2,
+        (min_value, min_index) = self.subtree_min_index_rec(A, 2 * i + 2,
             min_value, min_index)
 
         return (min_value, min_index)
@@ -1378,6 +2602,21 @@ class BuildHeapMatcher:
         Returns:
             True or False
         """
+        if not self.iterative_kernels:
+            return self.min_heap_property_rec(A, i)
+        # Compare each node of the subtree with its parent, level by level
+        n = len(A)
+        (l, r) = (i, i)
+        while True:
+            (l, r) = (2 * l + 1, min(2 * r + 2, n - 1))
+            if l >= n:
+                return True
+            for c in range(l, r + 1):
+                if A[(c - 1) // 2] > A[c]:
+                    return False
+
+    def min_heap_property_rec(self, A, i):
+        """Recursive implementation of min_heap_property()."""
         l = 2 * i + 1
         r = 2 * i + 2
         t = True
@@ -1385,12 +2624,12 @@ class BuildHeapMatcher:
             if A[i] > A[l]:
                 return False
             else:
-                t &= self.min_heap_property(A, l)
+                t &= self.min_heap_property_rec(A, l)
         if r < len(A):
             if A[i] > A[r]:
                 return False
             else:
-                t &= self.min_heap_property(A, r)
+                t &= self.min_heap_property_rec(A, r)
         return t
 
     def correct_with_extra_steps(self, student_states, correct_states):
@@ -1474,6 +2713,470 @@ class BuildHeapMatcher:
         return True
 
 
+# Bounded cache of candidate sequences of build_heap_variant(). When the cache
+# is full, the least recently used candidate is removed.
+class CandidateCache:
+
+    def __init__(self, max_size = 10000):
+        # key -> (swaps, state hashes) of a candidate, least recently used
+        # first
+        self.entries = collections.OrderedDict()
+
+        # Maximum number of candidates. 96 candidates are generated for
+        # each input.
+        self.max_size = max_size
+
+        # Number of successful and unsuccessful lookups
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Returns the candidate stored for key, or None."""
+        candidate = self.entries.get(key)
+        if candidate is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return candidate
+
+    def put(self, key, candidate):
+        """Stores a candidate, removing the least recently used one if the
+        cache is full."""
+        self.entries[key] = candidate
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last = False)
+
+    def clear(self):
+        """Removes all candidates and resets the counters."""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+# Sequence of heap array states of a candidate, constructed from its swaps.
+# Only the states which are accessed are constructed as tuples, so a candidate
+# whose swaps are compared by LCS never allocates its states.
+class LazyStates:
+
+    def __init__(self, input, swaps, hashes = None):
+        self.swaps = swaps
+
+        # Hashes of all states or None, see BuildHeapMatcher.state_hashes()
+        self.hashes = hashes
+
+        # States constructed so far, and the heap array after the last one
+        self.states = [tuple(input)]
+        self.current = list(input)
+
+        # (k, state k as a list) for equals()
+        self.scan = (0, list(input))
+
+    def materialize(self, n):
+        """Constructs the first n states."""
+        n = min(n, len(self.swaps) + 1)
+        A = self.current
+        for k in range(len(self.states) - 1, n - 1):
+            (i, j) = self.swaps[k][0:2]
+            A[i], A[j] = A[j], A[i]
+            self.states.append(tuple(A))
+
+    def equals(self, k, state):
+        """Tests whether state k is equal to state. The states up to k are
+        not constructed; state k is found by swapping from the state of the
+        previous call if k has not decreased, so comparing the states in
+        order costs O(n) time and memory for a heap of n elements."""
+        if k < 0:
+            k += len(self.swaps) + 1
+        if k < len(self.states):
+            return self.states[k] == state
+        (j, A) = self.scan
+        if k < j:
+            (j, A) = (len(self.states) - 1, list(self.states[-1]))
+        for s in self.swaps[j : k]:
+            A[s[0]], A[s[1]] = A[s[1]], A[s[0]]
+        self.scan = (k, A)
+        return len(A) == len(state) and tuple(A) == tuple(state)
+
+    def list(self):
+        """Returns all states as a list."""
+        self.materialize(len(self.swaps) + 1)
+        return self.states
+
+    def __len__(self):
+        return len(self.swaps) + 1
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return self.list()[k]
+        if k < 0:
+            k += len(self.swaps) + 1
+        if k >= len(self.states):
+            self.materialize(k + 1)
+        return self.states[k]
+
+    def __iter__(self):
+        for k in range(len(self.swaps) + 1):
+            yield self[k]
+
+    def __eq__(self, other):
+        try:
+            if len(other) != len(self.swaps) + 1:
+                return False
+        except TypeError:
+            return NotImplemented
+        # Compare state by state, stopping at the first difference
+        for k in range(len(self.swaps) + 1):
+            if not self.equals(k, other[k]):
+                return False
+        return True
+
+    def __repr__(self):
+        return repr(self.list())
+
+
+# Minimum of each subtree of a heap array, updated on swaps. In preorder, the
+# subtree rooted at node i occupies the consecutive positions from pre[i] to
+# pre[i] + size[i] - 1, so a segment tree over the preorder positions answers
+# the minimum of any subtree in O(log n) time.
+class SubtreeMinimumTree:
+
+    # Heap size -> (preorder, pre, size), see layout()
+    layouts = {}
+
+    def __init__(self, A):
+        """Builds the segment tree for heap array A. The tree refers to A;
+        it must be updated with swap() when A is modified."""
+        self.A = A
+        (preorder, self.pre, self.size) = self.layout(len(A))
+
+        # Leaves are at self.leaf_base + position. Each node stores the heap
+        # array index of the minimum of its leaves, or None for no leaves.
+        base = 1
+        while base < len(A):
+            base *= 2
+        self.leaf_base = base
+        self.nodes = [None] * base + list(preorder) + [None] * (
+            base - len(A))
+        for k in range(base - 1, 0, -1):
+            self.nodes[k] = self.smaller(self.nodes[2 * k],
+                self.nodes[2 * k + 1])
+
+    @classmethod
+    def layout(cls, N):
+        """Returns (preorder, pre, size) for heap size N: heap array indices
+        in preorder, the preorder position of each index and the size of the
+        subtree rooted at each index. Memoised for each size."""
+        layout = cls.layouts.get(N)
+        if layout is None:
+            preorder = []
+            stack = [0] if N > 0 else []
+            while stack:
+                i = stack.pop()
+                preorder.append(i)
+                if 2 * i + 2 < N:
+                    stack.append(2 * i + 2)
+                if 2 * i + 1 < N:
+                    stack.append(2 * i + 1)
+            pre = [0] * N
+            for k in range(N):
+                pre[preorder[k]] = k
+            size = [1] * N
+            for i in range(N - 1, 0, -1):
+                size[(i - 1) // 2] += size[i]
+            layout = (preorder, pre, size)
+            cls.layouts[N] = layout
+        return layout
+
+    def smaller(self, a, b):
+        """Returns heap array index a or b, whichever has the smaller value.
+        Index a must precede b in preorder; it is returned on ties."""
+        if a is None:
+            return b
+        if b is None or not self.A[b] < self.A[a]:
+            return a
+        return b
+
+    def minimum(self, i):
+        """Returns the index of the minimum in the subtree rooted at i. Of
+        equal values, the first one in preorder is chosen."""
+        A = self.A
+        nodes = self.nodes
+        l = self.leaf_base + self.pre[i]
+        r = l + self.size[i]
+        # Positions l..r-1 are all in the subtree, so the nodes covering them
+        # are not None.
+        left = None
+        right = None
+        while l < r:
+            if l & 1:
+                k = nodes[l]
+                if left is None or A[k] < A[left]:
+                    left = k
+                l += 1
+            if r & 1:
+                r -= 1
+                k = nodes[r]
+                if right is None or not A[right] < A[k]:
+                    right = k
+            l >>= 1
+            r >>= 1
+        if right is None or (left is not None and not A[right] < A[left]):
+            return left
+        return right
+
+    def swap(self, i, j):
+        """Swaps A[i] and A[j] and updates the tree."""
+        A = self.A
+        A[i], A[j] = A[j], A[i]
+        nodes = self.nodes
+        base = self.leaf_base
+        # Positions of the leaves stay the same; their values change.
+        for k in (base + self.pre[i], base + self.pre[j]):
+            k >>= 1
+            while k >= 1:
+                a = nodes[2 * k]
+                b = nodes[2 * k + 1]
+                if b is not None and A[b] < A[a]:
+                    a = b
+                nodes[k] = a
+                k >>= 1
+
+
+# Trie of the candidate sequences of one input. Candidates which begin with
+# the same states or swaps share the trie nodes of the common prefix, so a
+# similarity which is computed state by state, such as the greedy state
+# matching or a row of the LCS table, is computed once for each node instead
+# of once for each candidate.
+class CandidateTrie:
+
+    def __init__(self):
+        # Node 0 is the root, the empty prefix. Each other node has the last
+        # element of its prefix as its key.
+        self.keys = [None]
+        self.children = [{}]
+
+        # For candidates added with their states: (states, k) of each node,
+        # where states[k] is the state of the node in the first candidate
+        # which reached it
+        self.states = [None]
+
+        # Node of each candidate added, in the order of addition
+        self.ends = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, sequence, states = None):
+        """Adds a candidate sequence of states, hashes or swaps.
+
+        Parameters:
+        sequence: the elements of the candidate
+        states: if sequence contains the hashes of the states of a candidate,
+            its states as LazyStates; see BuildHeapMatcher.build_heap_variant()
+
+        Returns:
+        index of the candidate, 0 for the first one added, or None if the
+        candidate was not added because one of its states differs from the
+        state with the same hash in another candidate
+        """
+        node = 0
+        k = 0
+        # Common prefix with the candidates added earlier
+        while k < len(sequence):
+            child = self.children[node].get(sequence[k])
+            if child is None:
+                break
+            if states is not None and not self.same_state(child, states, k):
+                return None
+            node = child
+            k += 1
+
+        for k in range(k, len(sequence)):
+            child = len(self.keys)
+            self.keys.append(sequence[k])
+            self.children.append({})
+            self.states.append(None if states is None else (states, k))
+            self.children[node][sequence[k]] = child
+            node = child
+        self.ends.append(node)
+        return len(self.ends) - 1
+
+    def same_state(self, node, states, k):
+        """Tests whether state k of states, whose previous states are those
+        of the parent of node, is the state of node."""
+        if k == 0:
+            return True # the input
+        (C, k) = self.states[node]
+        (a, b) = (C.swaps[k - 1], states.swaps[k - 1])
+        if ((a[0] == b[0] and a[1] == b[1]) or
+            (a[0] == b[1] and a[1] == b[0])):
+            return True
+        return C.equals(k, states[k])
+
+    def traverse(self, step, initial):
+        """Computes a value for each node from the value of its parent:
+        step(parent value, node) -> value. The root has value initial.
+
+        Returns:
+        list of the values of the candidates in the order of addition
+        """
+        values = {}
+        ends = set(self.ends)
+        stack = [(0, initial)]
+        while stack:
+            (node, value) = stack.pop()
+            if node in ends:
+                values[node] = value
+            for child in self.children[node].values():
+                stack.append((child, step(value, child)))
+        return [values[node] for node in self.ends]
+
+    def state_similarity(self, S, S_index):
+        """BuildHeapMatcher.state_similarity_indexed() of each candidate with
+        student's states S, when the candidates were added as lists of
+        hashes with their states."""
+        keys = self.keys
+        states = self.states
+        def step(j, node):
+            positions = S_index.get(keys[node])
+            if positions is not None:
+                (C, k) = states[node]
+                for p in range(bisect.bisect_left(positions, j),
+                    len(positions)):
+                    if C.equals(k, S[positions[p]]):
+                        return positions[p] + 1
+            return j
+        return self.traverse(step, 0)
+
+    def lcs_similarity(self, Y):
+        """BuildHeapMatcher.lcs_similarity() of each candidate with Y. The
+        value of a node is the bit vector of the row of the LCS table for its
+        prefix, see BuildHeapMatcher.lcs_length()."""
+        masks = {}
+        for j in range(len(Y)):
+            masks[Y[j]] = masks.get(Y[j], 0) | (1 << j)
+        ones = (1 << len(Y)) - 1
+        keys = self.keys
+        def step(V, node):
+            U = V & masks.get(keys[node], 0)
+            return ((V + U) | (V - U)) & ones
+        return [len(Y) - bin(V).count('1')
+            for V in self.traverse(step, ones)]
+
+
+# Zobrist hashing of heap states. Each (array index, value) pair has a random
+# 64-bit key, and the hash of a state is the exclusive or of the keys of its
+# elements. A swap changes four keys, so the hashes of a sequence of states
+# are computed from its swaps in constant time per state. The values are
+# ranks: integers 0, 1, ..., n for heap size n.
+#
+# The key of a pair is computed from the pair with the SplitMix64 finaliser,
+# so no memory is needed for the keys of large heaps. The keys of indices and
+# values below table_size are looked up from a table instead.
+class ZobristHasher:
+
+    MASK = (1 << 64) - 1
+
+    def __init__(self, seed = 0, table_size = 64):
+        self.seed = seed & self.MASK
+        self.table_size = table_size
+
+        # table[i][x] is the key of value x at array index i, for i, x <
+        # table_size
+        self.table = [[self.key(i, x) for x in range(table_size)]
+            for i in range(table_size)]
+
+    def key(self, i, x):
+        """Returns the key of value x at array index i."""
+        MASK = self.MASK
+        z = (((i << 32) + x + self.seed) * 0x9E3779B97F4A7C15) & MASK
+        z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+        z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK
+        return z ^ (z >> 31)
+
+    def keys(self, i, x):
+        """Same as key() for NumPy arrays i and x of indices and values:
+        returns an array of uint64 keys."""
+        with numpy.errstate(over = 'ignore'):
+            i = numpy.asarray(i).astype(numpy.uint64)
+            x = numpy.asarray(x).astype(numpy.uint64)
+            z = ((i << numpy.uint64(32)) + x + numpy.uint64(self.seed)) * \
+                numpy.uint64(0x9E3779B97F4A7C15)
+            z = (z ^ (z >> numpy.uint64(30))) * \
+                numpy.uint64(0xBF58476D1CE4E5B9)
+            z = (z ^ (z >> numpy.uint64(27))) * \
+                numpy.uint64(0x94D049BB133111EB)
+            return z ^ (z >> numpy.uint64(31))
+
+    def small(self, A):
+        """Tests whether the keys of heap array A are in the table."""
+        return len(A) <= self.table_size and max(A, default = 0) < \
+            self.table_size
+
+    def hash_state(self, A):
+        """Returns the hash of heap array A."""
+        h = 0
+        if self.small(A):
+            table = self.table
+            for i in range(len(A)):
+                h ^= table[i][A[i]]
+        elif numpy is not None:
+            h = int(numpy.bitwise_xor.reduce(self.keys(
+                numpy.arange(len(A)), numpy.array(A, dtype = numpy.int64))))
+        else:
+            for i in range(len(A)):
+                h ^= self.key(i, A[i])
+        return h
+
+    def hash_sequence(self, input, swaps):
+        """Returns list of hashes of input and each state after a swap.
+
+        Parameters:
+        input: initial state of the heap array
+        swaps: list of tuples whose first two elements are the swapped indices
+        """
+        A = list(input)
+        h = self.hash_state(A)
+        hashes = [h]
+        if self.small(A):
+            table = self.table
+            for s in swaps:
+                (i, j) = (s[0], s[1])
+                (a, b) = (A[i], A[j])
+                (Ti, Tj) = (table[i], table[j])
+                h ^= Ti[a] ^ Tj[b] ^ Ti[b] ^ Tj[a]
+                A[i], A[j] = b, a
+                hashes.append(h)
+        elif numpy is not None and swaps:
+            # The keys of all swaps are computed at once
+            I = numpy.fromiter((s[0] for s in swaps), dtype = numpy.int64,
+                count = len(swaps))
+            J = numpy.fromiter((s[1] for s in swaps), dtype = numpy.int64,
+                count = len(swaps))
+            a = numpy.empty(len(swaps), dtype = numpy.int64)
+            b = numpy.empty(len(swaps), dtype = numpy.int64)
+            for k in range(len(swaps)):
+                (i, j) = (swaps[k][0], swaps[k][1])
+                a[k] = A[i]
+                b[k] = A[j]
+                A[i], A[j] = A[j], A[i]
+            keys = self.keys
+            changes = keys(I, a) ^ keys(J, b) ^ keys(I, b) ^ keys(J, a)
+            changes[0] ^= numpy.uint64(h)
+            hashes += numpy.bitwise_xor.accumulate(changes).tolist()
+        else:
+            key = self.key
+            for s in swaps:
+                (i, j) = (s[0], s[1])
+                (a, b) = (A[i], A[j])
+                h ^= key(i, a) ^ key(j, b) ^ key(i, b) ^ key(j, a)
+                A[i], A[j] = b, a
+                hashes.append(h)
+        return hashes
+
+
 # Generates Build-heap / Heapify main loop variants
 class MainLoopGenerator:
     
@@ -1489,6 +3192,10 @@ class MainLoopGenerator:
         
         # highest index of a node which has children
         self.last_i = 0                 
+
+        # Memoised loop variants: heap size -> tuple of (code, name,
+        # sequence), see loop_variants()
+        self.variants = {}
         
         
     def generate_levels(self, N):
@@ -1519,9 +3226,85 @@ class MainLoopGenerator:
     
     def down_lr(self):
         return [i for i in range(self.last_i + 1)]
-    
-    
-        
+
+    def level_lr(self):
+        """Levels bottom-up, each level from left to right."""
+        return [i for (l, r) in reversed(self.levels) for i in range(l, r + 1)]
+
+    def zigzag(self, left_to_right):
+        """Levels bottom-up, alternating direction. The lowest level with
+        children is traversed from left to right if left_to_right is True."""
+        sequence = []
+        for (l, r) in reversed(self.levels):
+            if left_to_right:
+                sequence += range(l, r + 1)
+            else:
+                sequence += range(r, l - 1, -1)
+            left_to_right = not left_to_right
+        return sequence
+
+    def zigzag_top_down(self):
+        """Levels top-down, alternating direction. The second level is
+        traversed from left to right."""
+        sequence = []
+        left_to_right = False # the root level
+        for (l, r) in self.levels:
+            if left_to_right:
+                sequence += range(l, r + 1)
+            else:
+                sequence += range(r, l - 1, -1)
+            left_to_right = not left_to_right
+        return sequence
+
+    def top_down_rl(self):
+        """Levels top-down, each level from right to left."""
+        return [i for (l, r) in self.levels for i in range(r, l - 1, -1)]
+
+    def inorder(self):
+        """Nodes which have children in inorder."""
+        sequence = []
+        stack = []
+        i = 0
+        while stack or i <= self.last_i:
+            if i <= self.last_i:
+                stack.append(i)
+                i = 2 * i + 1
+            else:
+                i = stack.pop()
+                sequence.append(i)
+                i = 2 * i + 2
+        return sequence
+
+    def loop_variants(self, N):
+        """Main loop variants of Build-heap for heap size N, in the same form
+        as BuildHeapMatcher.loop_variants. The sequences are memoised for
+        each size.
+
+        "Zigzag top-down LR" alternates direction level by level from the
+        root downward. "Zigzag top-down RL" traverses every level from right
+        to left, which is the rule of the sequence (0, 2, 1, 4, 3) of the
+        study for 10 elements.
+
+        Returns:
+        tuple of (code, name, sequence)
+        """
+        variants = self.variants.get(N)
+        if variants is None:
+            self.generate_levels(N)
+            variants = (
+                (100, 'Correct',            tuple(self.correct())),
+                (200, 'Zigzag RL',          tuple(self.zigzag(False))),
+                (300, 'Zigzag LR',          tuple(self.zigzag(True))),
+                (400, 'Level LR',           tuple(self.level_lr())),
+                (500, 'Top-down',           tuple(self.down_lr())),
+                (600, 'Zigzag top-down LR', tuple(self.zigzag_top_down())),
+                (700, 'Zigzag top-down RL', tuple(self.top_down_rl())),
+                (800, 'Inorder',            tuple(self.inorder()))
+            )
+            self.variants[N] = variants
+        return variants
+
+
 if __name__ == "__main__":
     m = BuildHeapMatcher()
 
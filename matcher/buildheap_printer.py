@@ -39,6 +39,22 @@ class BuildHeapPrinter:
             print(s)
 
     def print_heap_sequence(self, states, swaps):
+        """Prints binary tree representations of heap states, three states
+        side by side. The elements swapped after each state are shown in
+        parentheses. Heaps of other sizes than 10 are drawn with
+        heap_picture(), one state at a time.
+
+        Parameters:
+        states: a list of heap states
+        swaps:  a list of swaps (i, j)
+        """
+        if states and len(states[0]) != 10:
+            for i in range(len(states)):
+                swap = swaps[i] if i < len(swaps) else ()
+                for row in self.heap_picture(states[i], swap):
+                    print(row)
+                print()
+            return
 
         #              14                      14                      14
         #        ┌──────┴───┐            ┌──────┴───┐            ┌──────┴───┐
@@ -98,8 +114,65 @@ class BuildHeapPrinter:
             for r in rows:
                 print(r)
 
+    def heap_picture(self, state, swap = ()):
+        """Draws a binary tree representation of a heap of any size. The
+        nodes are placed in inorder, four characters per node.
+
+        Parameters:
+        state: heap array
+        swap:  indices of elements shown in parentheses
+
+        Returns:
+        list of strings, two rows for each level of the tree
+        """
+        N = len(state)
+        if N == 0:
+            return []
+
+        # Column of each node
+        x = [0] * N
+        column = 0
+        stack = []
+        i = 0
+        while stack or i < N:
+            if i < N:
+                stack.append(i)
+                i = 2 * i + 1
+            else:
+                i = stack.pop()
+                x[i] = column
+                column += 4
+                i = 2 * i + 2
+
+        depth = N.bit_length()
+        rows = [[' '] * column for k in range(2 * depth)]
+        for i in range(N):
+            d = (i + 1).bit_length() - 1
+            if i in swap:
+                text = "({0:2})".format(state[i])
+            else:
+                text = " {0:2} ".format(state[i])
+            rows[2 * d][x[i] : x[i] + 4] = list(text[-4:])
+
+            l = 2 * i + 1
+            if l < N:
+                row = rows[2 * d + 1]
+                parent = x[i] + 2
+                left = x[l] + 2
+                row[left : parent] = ['─'] * (parent - left)
+                row[left] = '┌'
+                if l + 1 < N:
+                    right = x[l + 1] + 2
+                    row[parent : right] = ['─'] * (right - parent)
+                    row[right] = '┐'
+                    row[parent] = '┴'
+                else:
+                    row[parent] = '┘'
+        return [''.join(row).rstrip() for row in rows if ''.join(row).strip()]
+
     def print_array_sequence(self, states, swaps):
-        print("   0   1   2   3   4   5   6   7   8   9")
+        N = len(states[0]) if states else 0
+        print(''.join("{0:4}".format(j) for j in range(N)))
         for i in range(len(states)):
             state = states[i]
             e = []
@@ -3,32 +3,89 @@
 
 import array
 
-def dtw(X, Y, d, return_array=False):
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# dtw_distances() uses NumPy for problems of at least this many cells. Smaller
+# ones are faster without it.
+NUMPY_MIN_CELLS = 400
+
+def dtw(X, Y, d, return_array=False, window=None, abandon=None):
     """Dynamic time warping (DTW) similarity of X and Y.
-    
+
     Parameters:
     X: first sequence
     Y: second sequence
     d: function (x,y) -> zero or positive Real value; distance between
        x and y, where x is member of X and y is member of Y
-    
+    return_array: if True, returns the cost array instead, see
+       dtw_distances()
+    window, abandon: see dtw_distances()
+
     Returns:
     0 if X == Y
     positive value otherwise. The lower the value, the more similar X and Y
     are.
-    
+
     Reference:
     Hiroaki Sakoe and Seibi Chiba. Dynamic Programming Algorithm
-    Optimizatino for Spoken Word Recognition. IEEE transactions on 
+    Optimizatino for Spoken Word Recognition. IEEE transactions on
     acoustics, speech, and signal processing, vol. ASSP-26, no. 1,
     February 1978, pages 43-49. DOI 10.1109/TASSP.1978.1163055.
     """
-    M = len(X)
-    N = len(Y)
-    
+    if len(X) == 0 or len(Y) == 0:
+        return 0
+
+    # D[j][i] = d(X[i], Y[j])
+    D = [[d(x, y) for x in X] for y in Y]
+    return dtw_distances(D, return_array, window, abandon)
+
+def dtw_distances(D, return_array=False, window=None, abandon=None):
+    """DTW of two sequences X and Y of lengths M and N from their distance
+    matrix: D[j][i] is the distance between X[i] and Y[j]. Uses NumPy if it
+    is installed and the matrix has at least NUMPY_MIN_CELLS cells.
+
+    Parameters:
+    D: list of N lists of M distances, or an N x M NumPy array
+    return_array: if True, returns the cost array of M * N float32 values,
+       where the cost of X[0...i] and Y[0...j] is at index j * M + i.
+    window: Sakoe-Chiba window, or None. If given, only cells where
+       |i - j| <= window are computed; others have infinite cost. The
+       window is widened to |M - N| so that the last cell can be reached.
+    abandon: early abandoning threshold, or None. When every warping path
+       is known to cost more than abandon, because every cell of a row (or
+       of two consecutive anti-diagonals) costs more, the computation stops.
+       The result is then infinite, and so are the costs of the cells not
+       computed. A DTW distance of at most abandon is always exact.
+
+    Returns:
+    DTW distance, or the cost array if return_array is True
+    """
+    N = len(D)
+    M = len(D[0]) if N > 0 else 0
     if M == 0 or N == 0:
         return 0
-    
+    if window is not None:
+        window = max(window, abs(M - N))
+    if numpy is None or M * N < NUMPY_MIN_CELLS:
+        if numpy is not None and isinstance(D, numpy.ndarray):
+            D = D.tolist()
+        g = dtw_python(D, M, N, window, abandon)
+    else:
+        g = dtw_numpy(D, M, N, window, abandon)
+
+    if (return_array):
+        return g
+    else:
+        return g[M * N - 1]
+
+def dtw_python(D, M, N, window, abandon):
+    """Computes the cost array of dtw_distances() row by row without
+    NumPy."""
+    inf = float('inf')
+
     # Cost array g:
     #
     #              i
@@ -43,31 +100,182 @@ def dtw(X, Y, d, return_array=False):
     # Array g is logically two-dimensional: G[i][j], where 0 <= i < M
     # and 0 <= j < N. This is mapped to one-dimensional array:
     # g[k] = j * M + i
-    g = array.array('f', [0] * M * N)
-    
-    # Initial cell
-    g[0] = 2 * d(X[0], Y[0])
-    
-    # top row: j = 0 (all samples of X against Y[0])
-    for i in range(1, M):
-        g[i] = g[i - 1] + d(X[i], Y[0])
-    
-    # leftmost column: i = 0 (all samples of Y against X[0])
-    for j in range(1, N):
-        g[j * M] = g[(j - 1) * M] + d(X[0], Y[j])
-    
-    # Cells 1 <= i < M and 1 <= j < N
-    for j in range(1, N):
-        for i in range(1, M):
-            d_ = d(X[i], Y[j])
-            v1 = g[(j - 1) * M + i] + d_
-            v2 = g[(j - 1) * M + i - 1] + 2 * d_
-            v3 = g[j * M + i - 1] + d_
-            g[j * M + i] = min(v1, v2, v3)
-          
-    if (return_array):
-        return g
-    else:
-        return g[M * N - 1]
+    g = array.array('f', [inf] * M * N)
+    if window is None:
+        window = max(M, N)
+
+    for j in range(N):
+        d = D[j]
+        row_min = inf
+        for i in range(max(0, j - window), min(M, j + window + 1)):
+            d_ = d[i]
+            if i == 0 and j == 0:
+                # Initial cell
+                v = 2 * d_
+            elif j == 0:
+                # top row: j = 0 (all samples of X against Y[0])
+                v = g[i - 1] + d_
+            elif i == 0:
+                # leftmost column: i = 0 (all samples of Y against X[0])
+                v = g[(j - 1) * M] + d_
+            else:
+                v1 = g[(j - 1) * M + i] + d_
+                v2 = g[(j - 1) * M + i - 1] + 2 * d_
+                v3 = g[j * M + i - 1] + d_
+                v = min(v1, v2, v3)
+            g[j * M + i] = v
+            row_min = min(row_min, g[j * M + i])
+        if abandon is not None and row_min > abandon:
+            g[M * N - 1] = inf
+            break
+    return g
+
+def dtw_numpy(D, M, N, window, abandon):
+    """Computes the cost array of dtw_distances() with NumPy, one
+    anti-diagonal (cells where i + j is constant) at a time. The cells of an
+    anti-diagonal depend only on the two previous anti-diagonals, so each
+    one is computed with a few vector operations."""
+    inf = numpy.inf
+
+    # Cost array with an extra row and column of infinite costs above and to
+    # the left, flattened: cell (i, j) is at (j + 1) * W + i + 1. An
+    # anti-diagonal is then a slice with step M, from the top right to the
+    # bottom left. The distances are in the same layout.
+    W = M + 1
+    G = numpy.full((N + 1) * W, inf, dtype = numpy.float32)
+    G[0] = 0 # makes the initial cell 2 * d(X[0], Y[0])
+    distances = numpy.zeros((N + 1) * W)
+    distances.reshape(N + 1, W)[1:, 1:] = D
+    if window is None:
+        window = max(M, N)
+
+    previous_min = inf # minimum of the previous anti-diagonal
+    for t in range(M + N - 1):
+        # Cells (i, t - i) of the anti-diagonal within the window
+        i_first = max(0, t - N + 1, (t - window + 1) // 2)
+        i_last = min(M - 1, t, (t + window) // 2)
+        if i_first > i_last:
+            continue
+        start = (t - i_last + 1) * W + i_last + 1
+        stop = (t - i_first + 1) * W + i_first + 1 + 1
+        d = distances[start : stop : M]
+        up = G[start - W : stop - W : M] + d
+        diagonal = G[start - W - 1 : stop - W - 1 : M] + 2 * d
+        left = G[start - 1 : stop - 1 : M] + d
+        cells = numpy.minimum(numpy.minimum(up, diagonal), left)
+        G[start : stop : M] = cells
+
+        # Every warping path visits one of two consecutive anti-diagonals.
+        if abandon is not None:
+            cells_min = cells.min()
+            if cells_min > abandon and previous_min > abandon:
+                G[(N + 1) * W - 1] = inf
+                break
+            previous_min = cells_min
 
-    
\ No newline at end of file
+    g = G.reshape(N + 1, W)[1:, 1:]
+    return array.array('f', g.tobytes())
+
+def dtw_search(Q, candidates, d = None, window = None):
+    """Finds the candidate sequence nearest to query sequence Q by DTW.
+
+    Full DTW is computed only for candidates which may still be nearer than
+    the best one found so far. The candidates are ranked by LB_Kim, a lower
+    bound of their DTW distance, and LB_Keogh is computed for each one in
+    turn. A candidate is pruned when a bound is greater than the best
+    distance so far, and the DTW of the others is abandoned early at it.
+
+    Parameters:
+    Q: query sequence
+    candidates: list of candidate sequences
+    d: distance function like in dtw(), or None for absolute difference
+       of numbers. LB_Keogh is only used with absolute difference; for
+       other functions, the candidates are pruned by LB_Kim only.
+    window: Sakoe-Chiba window, or None; see dtw_distances()
+
+    Returns:
+    (index, distance, statistics): index of the nearest candidate and its
+        DTW distance to Q. Of equally near candidates, the first one is
+        chosen. index is None if there are no candidates. statistics is a
+        dict:
+        'dtw': number of full DTW computations
+        'LB_Kim': number of candidates pruned by LB_Kim
+        'LB_Keogh': number of candidates pruned by LB_Keogh
+    """
+    keogh = d is None
+    if d is None:
+        d = lambda x, y: abs(x - y)
+    statistics = {'dtw': 0, 'LB_Kim': 0, 'LB_Keogh': 0}
+    envelopes = {}
+
+    ranked = sorted((lb_kim(Q, candidates[k], d), k)
+        for k in range(len(candidates)))
+    best = None
+    best_distance = float('inf')
+    for r in range(len(ranked)):
+        (kim, k) = ranked[r]
+        if kim > best_distance:
+            # The rest of the candidates have at least this bound
+            statistics['LB_Kim'] = len(ranked) - r
+            break
+        C = candidates[k]
+        if keogh and len(Q) > 0 and len(C) > 0:
+            w = max(len(Q), len(C)) if window is None else \
+                max(window, abs(len(Q) - len(C)))
+            if w not in envelopes:
+                envelopes[w] = envelope(Q, w)
+            if lb_keogh(C, envelopes[w]) > best_distance:
+                statistics['LB_Keogh'] += 1
+                continue
+
+        statistics['dtw'] += 1
+        abandon = None if best is None else best_distance
+        distance = dtw(Q, C, d, window = window, abandon = abandon)
+        if distance < best_distance or (distance == best_distance and
+            (best is None or k < best)):
+            best = k
+            best_distance = distance
+
+    return (best, best_distance, statistics)
+
+def lb_kim(X, Y, d):
+    """LB_Kim lower bound of the DTW distance of X and Y. Every warping path
+    starts from the first elements, with weight 2, and ends at the last
+    ones."""
+    if len(X) == 0 or len(Y) == 0:
+        return 0
+    bound = 2 * d(X[0], Y[0])
+    if len(X) > 1 or len(Y) > 1:
+        bound += d(X[-1], Y[-1])
+    return bound
+
+def envelope(Q, window):
+    """Envelope of numeric sequence Q for lb_keogh(): lists L and U, where
+    L[j] and U[j] are the minimum and maximum of Q[j - window ... j + window].
+    The lists extend to index len(Q) - 1 + window."""
+    L = []
+    U = []
+    for j in range(len(Q) + window):
+        part = Q[max(0, j - window) : j + window + 1]
+        L.append(min(part))
+        U.append(max(part))
+    return (L, U)
+
+def lb_keogh(C, envelope):
+    """LB_Keogh lower bound of the DTW distance of candidate C and query Q
+    with absolute difference as the distance function. Every warping path
+    visits each element of C with an element of Q within the window, so C[j]
+    costs at least its distance to the envelope of Q at j.
+
+    Parameters:
+    C: numeric sequence, at most window longer than Q
+    envelope: (L, U) of Q, see envelope()
+    """
+    (L, U) = envelope
+    bound = 0
+    for j in range(len(C)):
+        if C[j] > U[j]:
+            bound += C[j] - U[j]
+        elif C[j] < L[j]:
+            bound += L[j] - C[j]
+    return bound
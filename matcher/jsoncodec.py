@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# JSON encoding and decoding for JSAV downloader and JSAV matcher.
+#
+# The fastest installed JSON library is selected once when this module is
+# imported: orjson, then ujson, then the standard library module json.
+# Environment variable JSAV_JSON can name the library to use instead, for
+# example JSAV_JSON=json.
+
+import json
+import os
+
+
+def _json_loads(data):
+    return json.loads(data)
+
+def _json_dumps(obj, sort_keys = False, indent = None, default = None):
+    return json.dumps(obj, sort_keys = sort_keys, indent = indent,
+        default = default)
+
+# name: (loads, dumps) for each installed library
+codecs = {'json': (_json_loads, _json_dumps)}
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    def _orjson_loads(data):
+        return orjson.loads(data)
+
+    def _orjson_dumps(obj, sort_keys = False, indent = None, default = None):
+        if indent not in (None, 2):
+            # orjson only supports two-space indentation
+            return _json_dumps(obj, sort_keys, indent, default)
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent == 2:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default = default,
+            option = option).decode('utf-8')
+
+    codecs['orjson'] = (_orjson_loads, _orjson_dumps)
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+else:
+    def _ujson_loads(data):
+        return ujson.loads(data)
+
+    def _ujson_dumps(obj, sort_keys = False, indent = None, default = None):
+        if default is not None:
+            return _json_dumps(obj, sort_keys, indent, default)
+        return ujson.dumps(obj, sort_keys = sort_keys, indent = indent or 0)
+
+    codecs['ujson'] = (_ujson_loads, _ujson_dumps)
+
+
+def select(name = None):
+    """Selects the JSON library used by loads(), load() and dumps().
+
+    Parameters:
+    name: one of the keys of codecs, or None for the fastest installed one.
+    """
+    global name_selected, _loads, _dumps
+    if name is None:
+        for name in ('orjson', 'ujson', 'json'):
+            if name in codecs:
+                break
+    if name not in codecs:
+        raise Exception("JSON library '{}' is not installed".format(name))
+    name_selected = name
+    (_loads, _dumps) = codecs[name]
+
+
+def loads(data):
+    """Decodes a JSON document given as str or bytes."""
+    return _loads(data)
+
+
+def load(json_file):
+    """Decodes a JSON document from a file opened in text or binary mode."""
+    return _loads(json_file.read())
+
+
+# orjson and ujson reject content after a value, so they could find where a
+# value ends only by decoding it twice
+_json_decoder = json.JSONDecoder()
+
+
+def raw_decode(data, pos = 0):
+    """Decodes a JSON value which starts at data[pos] and may be followed by
+    other content. Like json.JSONDecoder.raw_decode(), which is used with
+    every library, raises json.JSONDecodeError if the value is incomplete.
+
+    Returns:
+    (value, end): end is the index in data after the value
+    """
+    return _json_decoder.raw_decode(data, pos)
+
+
+def dumps(obj, sort_keys = False, indent = None, default = None):
+    """Encodes obj as a JSON string. The parameters are similar to
+    json.dumps()."""
+    return _dumps(obj, sort_keys, indent, default)
+
+
+select(os.environ.get('JSAV_JSON'))
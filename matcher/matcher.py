@@ -4,10 +4,16 @@
 # Misconception matcher
 
 import csv
-import json
 import math
 import time
 from buildheap import BuildHeapMatcher
+import jsoncodec
+import recording_scanner
+
+try:
+    from batchheap import BatchHeapGenerator
+except ImportError:
+    BatchHeapGenerator = None
 
 class MisconceptionMatcher:
 
@@ -17,6 +23,13 @@ class MisconceptionMatcher:
         self.supportedTypes = ['buildheap', 'dijkstra', 'quicksort']
         self.buildheap = BuildHeapMatcher()
 
+        # Number of Build-heap submissions whose candidate sequences are
+        # generated at once with BatchHeapGenerator (requires NumPy), or 0
+        # to generate them one at a time. Batches pay off from about 1000
+        # submissions, and the candidate cache is enlarged to hold the
+        # candidates of a batch: about 100 MB per 1000 submissions.
+        self.candidate_batch_size = 0
+
     def check_field(self, data, key, value):
         """Verifies that given data is a dict with given key-value pair
 
@@ -38,12 +51,36 @@ class MisconceptionMatcher:
                 raise Exception("Field '{}' was '{}', should be '{}'!".format(key,
                     data[key],value))
 
-    def load_file(self, file_name):
-        """Loads a JSAV inspector file"""
+    def read_file(self, file_name, full_recordings):
+        """Reads the contents of a JSAV inspector file.
+
+        Parameters:
+        file_name: path of the file
+        full_recordings: if False, Build-heap recordings are read with
+                         recording_scanner and stored already parsed as
+                         tuples (input, states, swaps); see
+                         BuildHeapMatcher.parse_recording(). If True, or the
+                         file is of some other type, the whole file is
+                         decoded as JSON.
+        """
+        if not full_recordings:
+            try:
+                json_data = recording_scanner.scan_file(file_name)
+            except ValueError:
+                pass
+            else:
+                for s in json_data['submissions']:
+                    s['recording'] = self.buildheap.parse_steps(s.pop('steps'))
+                return json_data
+
+        with open(file_name, 'rb') as json_file:
+            return jsoncodec.load(json_file)
+
+    def load_file(self, file_name, full_recordings = False):
+        """Loads a JSAV inspector file. See read_file() for parameter
+        full_recordings."""
         print("Opening file {}".format(file_name))
-        json_data = {}
-        with open(file_name) as json_file:
-            json_data = json.load(json_file)
+        json_data = self.read_file(file_name, full_recordings)
 
         submission_count = 0
         try:
@@ -56,6 +93,7 @@ class MisconceptionMatcher:
             return
 
         self.exercise = json_data
+        self.buildheap.invalidate_parsed()
         meta = json_data['metadata']
 
         self.exercise['submission_by_id'] = {}
@@ -82,18 +120,17 @@ class MisconceptionMatcher:
         print("{} submissions".format(submission_count))
         print("----------- file loaded successfully")
 
-    def append_file(self, file_name):
+    def append_file(self, file_name, full_recordings = False):
         """Append a JSAV inspector file to already loaded data.
-        This provides support for data from multiple course instances."""
+        This provides support for data from multiple course instances.
+        See read_file() for parameter full_recordings."""
 
         print("Opening file {} to append in previous data".format(file_name))
 
         if self.exercise is None:
             raise Exception("Cannot use append_file(): load_file() not called!")
 
-        json_data = {}
-        with open(file_name) as json_file:
-            json_data = json.load(json_file)
+        json_data = self.read_file(file_name, full_recordings)
 
         submission_count = 0
         try:
@@ -187,10 +224,12 @@ class MisconceptionMatcher:
                 matching_options['matcher'] == 'loop_hypothesis_match'):
                 match_func = self.buildheap.loop_hypothesis_match
 
+            submissions = self.with_candidates(self.exercise['submissions'])
             for i in range(N):
-                s = self.exercise['submissions'][i]
+                s = next(submissions)
 
-                cls = match_func(s['recording'], matching_options, debug_text)
+                cls = match_func(s['recording'], matching_options, debug_text,
+                    s['id'])
                 if 'manual_class' in s and cls == s['manual_class']:
                     correct += 1
                 classes[i] = cls
@@ -208,6 +247,28 @@ class MisconceptionMatcher:
             
         self.buildheap.print_statistics()
 
+    def with_candidates(self, submissions):
+        """Iterates Build-heap submissions. If self.candidate_batch_size > 0,
+        the candidate sequences of the submissions are generated in batches
+        with BatchHeapGenerator before the submissions of the batch."""
+        batch_size = self.candidate_batch_size
+        if batch_size <= 0:
+            yield from submissions
+            return
+        if BatchHeapGenerator is None:
+            raise Exception("candidate_batch_size requires NumPy")
+
+        generator = BatchHeapGenerator(self.buildheap)
+        cache = self.buildheap.candidate_cache
+        variant_count = (len(self.buildheap.loop_variants) *
+            len(self.buildheap.heapify_algorithms))
+        cache.max_size = max(cache.max_size, batch_size * variant_count)
+        for start in range(0, len(submissions), batch_size):
+            batch = submissions[start : start + batch_size]
+            generator.prefill([self.buildheap.parsed_recording(s['recording'],
+                s['id'])[0] for s in batch])
+            yield from batch
+
     def build_heap_replicated_study(self):
         """Similar to match_submissions(), but for replicated study of
         Build-Heap according to the following studies.
@@ -248,8 +309,9 @@ class MisconceptionMatcher:
         print("Build-Heap replicated study")
         print("Id Variant Completeness")
 
-        for s in self.exercise['submissions']:
-            cls = self.buildheap.replicated_study_match(s['recording'])
+        for s in self.with_candidates(self.exercise['submissions']):
+            cls = self.buildheap.replicated_study_match(s['recording'],
+                s['id'])
             if (cls[1] == 'Finished'):
                 variant_count[cls[0]][0] += 1
             else:
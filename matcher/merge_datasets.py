@@ -0,0 +1,243 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Merges JSAV inspector files of the same exercise type into one file.
+#
+# Usage: python3 merge_datasets.py <output.json> <input.json> [input.json ...]
+#
+# Overlapping downloads, such as 2019 and 2019-en, may contain the same
+# submission more than once. Each submission id is written only once, sorted
+# by id. Duplicates and conflicts are listed in <output>-conflicts.csv.
+
+import bisect
+import csv
+import hashlib
+import json
+import sys
+import tempfile
+
+import jsoncodec
+
+
+def stream_file(file_name, chunk_size = 1 << 20):
+    """Reads a JSAV inspector file one submission at a time.
+
+    Parameters:
+    file_name: path of a JSAV inspector file
+    chunk_size: number of characters read from the file at a time
+
+    Returns:
+    (header, submissions): header is a dict with fields 'application',
+    'version' and 'metadata'. submissions is an iterator which decodes the
+    submissions one at a time, so that only one submission is in memory at
+    once.
+    """
+    f = open(file_name, encoding='utf-8')
+    buffer = ''
+    pos = -1
+    while pos < 0:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            f.close()
+            raise Exception("Field 'submissions' not found in {}"
+                .format(file_name))
+        buffer += chunk
+        pos = buffer.find('"submissions"')
+        if pos >= 0 and buffer.find('[', pos) < 0:
+            pos = -1
+    header = jsoncodec.loads(buffer[:pos].rstrip().rstrip(',') + '}')
+    pos = buffer.index('[', pos) + 1
+
+    def submissions(buffer, pos):
+        with f:
+            while True:
+                # Skip separators between submissions
+                while True:
+                    while pos < len(buffer) and buffer[pos] in ' \t\r\n,':
+                        pos += 1
+                    if pos < len(buffer):
+                        break
+                    buffer = f.read(chunk_size)
+                    pos = 0
+                    if not buffer:
+                        raise Exception("Unexpected end of file {}"
+                            .format(file_name))
+                if buffer[pos] == ']':
+                    return
+
+                # Decode one submission, reading more if it is incomplete
+                while True:
+                    try:
+                        (submission, end) = jsoncodec.raw_decode(buffer, pos)
+                        break
+                    except json.JSONDecodeError:
+                        chunk = f.read(chunk_size)
+                        if not chunk:
+                            raise
+                        buffer = buffer[pos:] + chunk
+                        pos = 0
+                yield submission
+                pos = end
+
+    return (header, submissions(buffer, pos))
+
+
+def recording_digest(recording):
+    """Returns an 8-byte digest of a recording which does not depend on the
+    whitespace or key order of the file it was read from."""
+    text = jsoncodec.dumps(recording, sort_keys = True)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size = 8).digest()
+
+
+class DatasetMerger:
+
+    def __init__(self):
+        # Submission ids written so far. Together with the spool index this
+        # is the only bookkeeping which grows with the dataset, O(#ids);
+        # recordings stay in the spool file.
+        self.seen = set()
+
+        # Tuples (submission id, recording digest, file) of submissions whose
+        # id was already seen. They are classified when the merge ends.
+        self.repeated = []
+
+        # Input files and their metadata
+        self.input_files = []
+        self.metadata = []
+
+        # Tuples (submission id, kind, file, first file). Kind is 'duplicate'
+        # for a submission identical to an earlier one, and 'conflict' for a
+        # different recording with an earlier submission id. Filled in by
+        # merge().
+        self.conflicts = []
+
+        # Number of characters read from an input file at a time
+        self.chunk_size = 1 << 20
+
+    def merge(self, input_files, output_file, report_file = None):
+        """Merges input files into output_file.
+
+        Parameters:
+        input_files: list of paths of JSAV inspector files, all of the same
+                     exercise type
+        output_file: path of the merged file. Its metadata is that of the
+                     first input file, with field 'merged_from' listing the
+                     metadata of each input file.
+        report_file: path of a CSV file listing duplicates and conflicts, or
+                     None
+
+        Returns:
+        number of submissions written
+        """
+        if not input_files:
+            raise Exception("No input files to merge")
+
+        # Unique submissions are encoded into a spool file in the order they
+        # are read. The index of (id, offset, length, file index) is sorted
+        # at the end.
+        index = []
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as spool:
+            for file_name in input_files:
+                self.merge_file(file_name, spool, index)
+            index.sort()
+            self.classify_repeated(spool, index)
+
+            metadata = dict(self.metadata[0])
+            del metadata['submission_count']
+            metadata['merged_from'] = [dict(m, file = f) for (f, m) in
+                zip(self.input_files, self.metadata)]
+            self.write(output_file, metadata, spool, index)
+
+        if report_file is not None:
+            self.write_report(report_file)
+
+        return len(index)
+
+    def merge_file(self, file_name, spool, index):
+        """Reads one input file, writing new submissions into spool and
+        index."""
+        (header, submissions) = stream_file(file_name, self.chunk_size)
+        file_index = len(self.input_files)
+        metadata = header['metadata']
+        if file_index > 0:
+            expected_type = self.metadata[0]['type']
+            if metadata['type'] != expected_type:
+                raise Exception(("The exercise type of earlier file was {}, "
+                    "but file {} has type {}").format(expected_type,
+                    file_name, metadata['type']))
+        self.input_files.append(file_name)
+        self.metadata.append(metadata)
+
+        count = 0
+        for s in submissions:
+            id = s['id']
+            if id in self.seen:
+                self.repeated.append((id, recording_digest(s['recording']),
+                    file_name))
+                continue
+            self.seen.add(id)
+
+            # The recording is the last field, as in JSAV-downloader.py
+            fields = {k: v for (k, v) in s.items() if k != 'recording'}
+            fields['recording'] = s['recording']
+            text = jsoncodec.dumps(fields)
+            index.append((id, spool.tell(), len(text), file_index))
+            spool.write(text)
+            count += 1
+
+        metadata['submission_count'] = count
+        print("{}: {} new submissions".format(file_name, count))
+
+    def classify_repeated(self, spool, index):
+        """Compares each repeated submission with the first submission of the
+        same id in spool, and adds it to self.conflicts. index must be
+        sorted."""
+        for (id, digest, file_name) in self.repeated:
+            i = bisect.bisect_left(index, (id,))
+            (_, offset, length, first_file) = index[i]
+            spool.seek(offset)
+            first = jsoncodec.loads(spool.read(length))
+            if digest == recording_digest(first['recording']):
+                kind = 'duplicate'
+            else:
+                kind = 'conflict'
+            self.conflicts.append((id, kind, file_name,
+                self.input_files[first_file]))
+        self.repeated = []
+
+    def write(self, output_file, metadata, spool, index):
+        """Writes the merged file from the spool in the order of index."""
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write('{\n'
+                '  "application" : "JSAV Inspector",\n'
+                '  "version"     : 1,\n'
+                '  "metadata"    : ' + jsoncodec.dumps(metadata) + ',\n'
+                '  "submissions" : [\n')
+            comma = ''
+            for (id, offset, length, _) in index:
+                spool.seek(offset)
+                f.write('  ' + comma + spool.read(length) + '\n')
+                comma = ','
+            f.write("]\n}\n")
+
+    def write_report(self, report_file):
+        with open(report_file, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['id', 'kind', 'file', 'first_file'])
+            for c in sorted(self.conflicts):
+                writer.writerow(c)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: {} <output.json> <input.json> [input.json ...]"
+            .format(sys.argv[0]))
+    else:
+        output_file = sys.argv[1]
+        report_file = output_file.rsplit('.', 1)[0] + '-conflicts.csv'
+        merger = DatasetMerger()
+        count = merger.merge(sys.argv[2:], output_file, report_file)
+        duplicates = sum(1 for c in merger.conflicts if c[1] == 'duplicate')
+        print("{} submissions written to {}".format(count, output_file))
+        print("{} duplicates, {} conflicts, see {}".format(duplicates,
+            len(merger.conflicts) - duplicates, report_file))
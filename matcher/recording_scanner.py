@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+
+# Fast loader for Build-heap recordings in JSAV inspector files.
+#
+# json.load() builds a dict for every heap array element of every step
+# ({'v': x}) and a string for every 'style' and 'classes' field, even though
+# Build-heap matching only needs the integer values. This module finds the
+# values directly from the raw bytes of the file instead.
+
+import array
+import mmap
+import re
+
+import jsoncodec
+
+# Key of the recording of a submission
+_RECORDING_KEY = re.compile(rb'"recording"\s*:\s*')
+
+# Key of the heap array of one step
+_IND_KEY = re.compile(rb'"ind"')
+
+# Integer value of one heap array element inside a step: {"v": 14, ...}
+_V_VALUE = re.compile(rb'"v"\s*:\s*(-?\d+)\s*[,}]')
+
+
+def scan_file(file_name):
+    """Reads a Build-heap JSAV inspector file without constructing the JSON
+    objects of the recordings.
+
+    The file must have the layout written by JSAV-downloader.py: "submissions"
+    is the last field of the top-level object, and "recording" is the last
+    field of each submission, preceded only by scalar fields.
+
+    Parameters:
+    file_name: path of a JSAV inspector file
+
+    Returns:
+    dict with the same fields as the JSON file: 'application', 'version',
+    'metadata' and 'submissions'. In each submission, field 'recording' is
+    replaced by field 'steps': a list of tuples, each containing the heap array
+    values of one step of the recording.
+
+    Raises:
+    ValueError if the file is not a Build-heap file or does not have the
+    expected layout.
+    """
+    with open(file_name, 'rb') as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return scan_buffer(mm)
+
+
+def scan_buffer(data):
+    """Same as scan_file(), but reads a bytes-like object, such as bytes or
+    mmap."""
+
+    submissions_pos = data.find(b'"submissions"')
+    if submissions_pos < 0:
+        raise ValueError("Field 'submissions' not found")
+
+    # Everything before "submissions" is the header: application, version and
+    # metadata. It is small, so it is decoded as regular JSON.
+    header = jsoncodec.loads(
+        data[:submissions_pos].rstrip().rstrip(b',') + b'}')
+    if header.get('metadata', {}).get('type') != 'buildheap':
+        raise ValueError("Not a Build-heap file")
+
+    key_positions = [(m.start(), m.end())
+        for m in _RECORDING_KEY.finditer(data, submissions_pos)]
+
+    # Start index of each submission object: the nearest '{' before the
+    # "recording" key, as the preceding fields are scalars.
+    object_starts = []
+    previous_end = submissions_pos
+    for (key_start, key_end) in key_positions:
+        object_start = data.rfind(b'{', previous_end, key_start)
+        if object_start < 0:
+            raise ValueError("Submission without fields at byte {}"
+                .format(key_start))
+        object_starts.append(object_start)
+        previous_end = key_end
+
+    submissions = []
+    for k in range(len(key_positions)):
+        (key_start, key_end) = key_positions[k]
+        fields = data[object_starts[k] + 1 : key_start].rstrip().rstrip(b',')
+        submission = jsoncodec.loads(b'{' + fields + b'}')
+
+        # The recording continues until the next submission begins. The
+        # closing brackets in between do not contain values.
+        if k + 1 < len(key_positions):
+            recording_end = object_starts[k + 1]
+        else:
+            recording_end = len(data)
+        submission['steps'] = scan_recording(data[key_end : recording_end])
+        submissions.append(submission)
+
+    header['submissions'] = submissions
+    return header
+
+
+def scan_recording(recording):
+    """Finds the heap array values of each step of a raw Build-heap recording.
+
+    Parameters:
+    recording: bytes of a JSAV recording (a JSON list of steps)
+
+    Returns:
+    list of tuples, each containing the heap array values of one step
+
+    Raises:
+    ValueError if some value is not an integer or the steps have different
+    sizes.
+    """
+    step_starts = [m.start() for m in _IND_KEY.finditer(recording)]
+    step_count = len(step_starts)
+    if step_count == 0:
+        return []
+
+    values = array.array('l', map(int, _V_VALUE.findall(recording)))
+    if len(values) != recording.count(b'"v"'):
+        raise ValueError("Non-integer heap array value in recording")
+
+    # Each step must have as many values as the first one. Comparing only the
+    # total would accept e.g. steps of sizes 3, 2 and 4 and split them at the
+    # wrong places.
+    step_starts.append(len(recording))
+    array_size = recording.count(b'"v"', step_starts[0], step_starts[1])
+    if array_size == 0 or array_size * step_count != len(values):
+        raise ValueError("Steps of the recording have different sizes")
+    for k in range(1, step_count):
+        if recording.count(b'"v"', step_starts[k],
+                step_starts[k + 1]) != array_size:
+            raise ValueError("Steps of the recording have different sizes")
+
+    # Group the flat buffer into one tuple per step
+    return list(zip(*[iter(values)] * array_size))
+
+
+if __name__ == "__main__":
+    # Compares the scanner to json.load() + parse_recording() for the given
+    # files.
+    import json
+    import sys
+    import time
+    from buildheap import BuildHeapMatcher
+
+    m = BuildHeapMatcher()
+    for file_name in sys.argv[1:]:
+        t1 = time.perf_counter()
+        with open(file_name) as json_file:
+            json_data = json.load(json_file)
+        expected = [m.parse_recording(s['recording'])
+            for s in json_data['submissions']]
+        t2 = time.perf_counter()
+        scanned = scan_file(file_name)
+        result = [m.parse_steps(s['steps']) for s in scanned['submissions']]
+        t3 = time.perf_counter()
+
+        print("{}: {} submissions, {}".format(file_name, len(result),
+            "equal" if result == expected else "DIFFERENT"))
+        print("  json.load + parse_recording: {:.3f} s".format(t2 - t1))
+        print("  scan_file + parse_steps:     {:.3f} s".format(t3 - t2))
@@ -7,9 +7,22 @@ Created on 4 Dec 2019
 @author: atilante
 '''
 import copy
+import json
+import os
+import random
+import tempfile
+import time
 import unittest
+import buildheap
 from buildheap import BuildHeapMatcher, MainLoopGenerator
+if buildheap.numpy is not None:
+    from batchheap import BatchHeapGenerator
 from dtw import dtw
+import dtw as dtw_module
+import jsoncodec
+from matcher import MisconceptionMatcher
+from merge_datasets import DatasetMerger
+import recording_scanner
 
 class TestBuildHeapMatcher(unittest.TestCase):
 
@@ -110,6 +123,389 @@ class TestBuildHeapMatcher(unittest.TestCase):
         self.assertListEqual(states, result_states)
         self.assertListEqual(swaps, result_swaps)
 
+    @unittest.skipIf(buildheap.numpy is None, "NumPy not installed")
+    def test_parse_steps_vectorized(self):
+        """parse_steps_vectorized() gives the same result as parse_steps()"""
+        m = BuildHeapMatcher()
+        m.vectorized_parse_steps = 1000000 # never vectorize parse_steps()
+        rnd = random.Random(1)
+        for length in (1, 2, 5, 200):
+            A = [rnd.randint(0, 5) for i in range(8)]
+            steps = [list(A)]
+            for k in range(length):
+                x = rnd.random()
+                if x < 0.5:   # swap
+                    i, j = rnd.sample(range(len(A)), 2)
+                    A[i], A[j] = A[j], A[i]
+                elif x < 0.7: # some other change
+                    A[rnd.randrange(len(A))] = rnd.randint(0, 5)
+                steps.append(list(A))
+            self.assertEqual(m.parse_steps_vectorized(steps),
+                             m.parse_steps(steps))
+
+    def test_parse_cache(self):
+        """Each recording is parsed only once by the matcher entry points."""
+        m = BuildHeapMatcher()
+        parse_count = [0]
+        parse_recording = m.parse_recording
+        def counting_parse_recording(recording):
+            parse_count[0] += 1
+            return parse_recording(recording)
+        m.parse_recording = counting_parse_recording
+
+        recording = [{'ind': [{'v': x} for x in A]} for A in
+                     [[14, 17, 13, 15, 16, 12, 11, 19, 18, 10],
+                      [14, 17, 13, 15, 10, 12, 11, 19, 18, 16],
+                      [14, 17, 13, 15, 10, 12, 11, 19, 18, 16]]]
+        options = {'similarity': 'lcs', 'Jaccard': False, 'threshold': 0,
+                   'verbosity': 0}
+        m.match(recording, options, [], 17)
+        m.loop_hypothesis_match(recording, options, [], 17)
+        m.replicated_study_match(recording, 17)
+        self.assertEqual(parse_count[0], 1)
+
+        # Without submission id, the recording object is the key
+        m.match(recording, options)
+        m.match(recording, options)
+        self.assertEqual(parse_count[0], 2)
+
+        m.invalidate_parsed(submission_id = 17)
+        m.match(recording, options, [], 17)
+        self.assertEqual(parse_count[0], 3)
+        m.invalidate_parsed(recording = recording)
+        m.match(recording, options)
+        self.assertEqual(parse_count[0], 4)
+
+        # Another file repeats submission id 17 with a different recording
+        other = [recording[0], recording[0]]
+        self.assertEqual(m.parsed_recording(other, 17)[2], [])
+        self.assertEqual(parse_count[0], 5)
+        self.assertEqual(len(m.parsed_recording(recording, 17)[2]), 1)
+
+        m.invalidate_parsed()
+        self.assertEqual(m.parse_cache, {})
+
+    @unittest.skipIf(buildheap.numpy is None, "NumPy not installed")
+    def test_dtw_similarity(self):
+        """The 'dtw' similarity is DTW of states with Hamming distance."""
+        m = BuildHeapMatcher()
+        input = [14, 17, 13, 15, 16, 12, 11, 19, 18, 10]
+        options = {'similarity': 'dtw', 'Jaccard': False, 'threshold': 0,
+                   'verbosity': 1}
+        (states, swaps) = m.build_heap_variant((3, 4, 1, 2, 0),
+            m.path_bubblesort, input)
+        states = states.list()
+        debug_text = []
+        m.match((input, states, swaps), options, debug_text)
+        best = debug_text[0].split()
+        self.assertEqual(best[0], '1.0')
+        self.assertIn('410', best[1:])
+
+        # A student's sequence with a wrong state
+        states[2] = tuple(reversed(states[2]))
+        candidates = []
+        for loop in m.loop_variants_for(len(input)):
+            for algo in m.heapify_algorithms:
+                candidates.append(m.build_heap_variant(loop[2], algo[2],
+                    input)[0])
+        (columns, distances) = m.state_distances(input, states, candidates)
+        hamming = lambda x, y: sum(1 for k in range(len(x)) if x[k] != y[k])
+        for C in candidates:
+            self.assertEqual(m.dtw_similarity(C.hashes, columns, distances),
+                1 / (1 + dtw(list(C), states, hamming)))
+
+    def test_similarity_bound_pruning(self):
+        """Skipping candidates by similarity_bound() gives the same classes
+        and the same equally best classes."""
+        m = BuildHeapMatcher()
+        m.candidate_trie = False
+        unpruned = BuildHeapMatcher()
+        unpruned.candidate_trie = False
+        unpruned.similarity_bound = lambda *args: float('inf')
+        evaluations = [0]
+        lcs_similarity = m.lcs_similarity
+        def counting_lcs_similarity(X, Y):
+            evaluations[0] += 1
+            return lcs_similarity(X, Y)
+        m.lcs_similarity = counting_lcs_similarity
+
+        rnd = random.Random(11)
+        for k in range(20):
+            input = rnd.sample(range(10, 100), 10)
+            (states, swaps) = m.build_heap_variant((4, 3, 1, 2, 0),
+                m.no_recursion, input)
+            swaps = list(swaps[0:rnd.randint(0, len(swaps))])
+            swaps.append((rnd.randrange(10), rnd.randrange(10)))
+            recording = (input, m.states_from_swaps(input, swaps), swaps)
+            for similarity in ('states', 'lcs'):
+                for jaccard in (False, True):
+                    options = {'similarity': similarity, 'Jaccard': jaccard,
+                               'threshold': 0, 'verbosity': 1}
+                    (text, expected) = ([], [])
+                    self.assertEqual(m.match(recording, options, text),
+                        unpruned.match(recording, options, expected))
+                    self.assertEqual(text, expected)
+                    self.assertEqual(m.loop_hypothesis_match(recording,
+                        options), unpruned.loop_hypothesis_match(recording,
+                        options))
+        self.assertLess(evaluations[0], 20 * 2 * 2 * 88)
+
+    def test_candidate_cache(self):
+        """Candidates of build_heap_variant() are generated once per input."""
+        m = BuildHeapMatcher()
+        input = [14, 17, 13, 15, 16, 12, 11, 19, 18, 10]
+        recording = (input, [tuple(input)], [])
+        options = {'similarity': 'states', 'Jaccard': False, 'threshold': 0,
+                   'verbosity': 0}
+        m.match(recording, options)
+        self.assertEqual(m.candidate_cache.hits, 0)
+        self.assertEqual(m.candidate_cache.misses, 96)
+        m.loop_hypothesis_match(recording, options)
+        self.assertEqual(m.candidate_cache.misses, 96)
+        self.assertGreaterEqual(m.candidate_cache.hits, 96)
+
+        expected = m.build_heap_variant((4, 3, 2, 1, 0), m.min_heapify, input)
+        m.candidate_cache.clear()
+        self.assertEqual(m.build_heap_variant((4, 3, 2, 1, 0), m.min_heapify,
+            list(input)), expected)
+
+        # The least recently used candidate is removed first
+        m.candidate_cache.max_size = 2
+        m.build_heap_variant((4, 3, 2, 1, 0), m.max_heapify, input)
+        m.build_heap_variant((4, 3, 2, 1, 0), m.min_heapify, input)
+        m.build_heap_variant((4, 3, 2, 1, 0), m.heapify_up, input)
+        self.assertEqual(len(m.candidate_cache.entries), 2)
+        self.assertNotIn(((4, 7, 3, 5, 6, 2, 1, 9, 8, 0), (4, 3, 2, 1, 0),
+            'max_heapify'), m.candidate_cache.entries)
+
+    def test_candidate_cache_ranks(self):
+        """Inputs with the same rank pattern share cached candidates."""
+        m = BuildHeapMatcher()
+        inputs = [[14, 17, 13, 15, 16, 12, 11, 19, 18, 10],
+                  [40, 70, 30, 50, 60, 20, 15, 99, 80, 1],
+                  [5, 3, 3, 7, 3, 9, 1, 1, 8, 2],
+                  [50, 30, 30, 70, 30, 90, 10, 10, 80, 20]]
+        for input in inputs:
+            for loop in m.loop_variants:
+                for algo in m.heapify_algorithms:
+                    A = list(input)
+                    states = [tuple(A)]
+                    swaps = []
+                    for i in loop[2]:
+                        algo[2](A, i, states, swaps)
+                    self.assertEqual(m.build_heap_variant(loop[2], algo[2],
+                        input), (states, swaps))
+        self.assertEqual(m.candidate_cache.misses, 2 * 96)
+        self.assertEqual(m.candidate_cache.hits, 2 * 96)
+
+    def test_lazy_states(self):
+        """Candidate states are constructed from swaps when accessed."""
+        m = BuildHeapMatcher()
+        input = [14, 17, 13, 15, 16, 12, 11, 19, 18, 10]
+        (states, swaps) = m.build_heap_variant((4, 3, 2, 1, 0), m.min_heapify,
+            input)
+        self.assertIsInstance(states, buildheap.LazyStates)
+        self.assertEqual(len(states), len(swaps) + 1)
+        self.assertEqual(len(states.states), 1)
+        self.assertEqual(states[1], (14, 17, 13, 15, 10, 12, 11, 19, 18, 16))
+        self.assertEqual(len(states.states), 2)
+        self.assertEqual(states[-1], (10, 14, 11, 15, 16, 12, 13, 19, 18, 17))
+        self.assertEqual(states, m.states_from_swaps(input, swaps))
+        self.assertNotEqual(states, m.states_from_swaps(input, swaps[:-1]))
+        self.assertEqual(list(states), states[:])
+
+    def test_state_hashes(self):
+        """Zobrist hashes of candidates and students' states agree."""
+        m = BuildHeapMatcher()
+        hasher = buildheap.ZobristHasher()
+        A = [3, 1, 4, 0, 2]
+        swaps = [(0, 3), (1, 4), (0, 1)]
+        hashes = hasher.hash_sequence(A, swaps)
+        states = m.states_from_swaps(A, swaps)
+        self.assertEqual(hashes, [hasher.hash_state(S) for S in states])
+        self.assertEqual(len(set(hashes)), len(hashes))
+
+        # Keys of large heaps are computed, not stored
+        A = list(range(200))
+        random.Random(12).shuffle(A)
+        swaps = [(0, 199), (5, 70), (199, 5)]
+        hashes = hasher.hash_sequence(A, swaps)
+        self.assertEqual(hashes, [hasher.hash_state(S) for S in
+            m.states_from_swaps(A, swaps)])
+        self.assertEqual(len(set(hashes)), len(hashes))
+        self.assertEqual(len(hasher.table), hasher.table_size)
+        self.assertEqual(hasher.table[3][5], hasher.key(3, 5))
+
+        input = [14, 17, 13, 15, 16, 12, 11, 19, 18, 10]
+        for algo in m.heapify_algorithms:
+            (C, C_swaps) = m.build_heap_variant((4, 3, 2, 1, 0), algo[2],
+                input)
+            self.assertEqual(C.hashes, m.state_hashes(input, C))
+
+        # Student's sequence with an extra and a foreign state
+        (C, C_swaps) = m.build_heap_variant((4, 3, 2, 1, 0), m.min_heapify,
+            input)
+        S = [C[0], C[1], tuple(range(10)), C[2], C[3]]
+        S_hashes = m.state_hashes(input, S)
+        self.assertEqual(m.state_similarity(C, S, C.hashes, S_hashes),
+            m.state_similarity(C.list(), S))
+        self.assertFalse(m.same_states(C, S, S_hashes))
+        self.assertTrue(m.same_states(C, C.list(), C.hashes))
+
+    @unittest.skipIf(buildheap.numpy is None, "NumPy not installed")
+    def test_batch_candidates(self):
+        """Batched candidate generation equals build_heap_variant()."""
+        m = BuildHeapMatcher()
+        generator = BatchHeapGenerator(m)
+        rnd = random.Random(5)
+        inputs = [rnd.sample(range(100), 10) for k in range(30)]
+        inputs += [[rnd.randint(1, 4) for j in range(10)] for k in range(30)]
+        for loop in m.loop_variants:
+            for algo in m.heapify_algorithms:
+                all_swaps = generator.generate(loop[2], algo[2], inputs)
+                for k in range(len(inputs)):
+                    self.assertEqual(all_swaps[k],
+                        m.build_heap_variant(loop[2], algo[2], inputs[k])[1])
+
+        # Prefilled candidates have the same swaps and hashes
+        m2 = BuildHeapMatcher()
+        m2.candidate_cache.max_size = 100000
+        self.assertEqual(BatchHeapGenerator(m2).prefill(inputs + inputs),
+            len(inputs))
+        self.assertEqual(dict(m2.candidate_cache.entries),
+            dict(m.candidate_cache.entries))
+
+    def test_iterative_kernels(self):
+        """Iterative and recursive heapify kernels perform the same swaps."""
+        iterative = BuildHeapMatcher()
+        recursive = BuildHeapMatcher()
+        recursive.iterative_kernels = False
+        rnd = random.Random(8)
+        for N in (1, 2, 10, 33, 200):
+            input = [rnd.randint(0, N // 2) for k in range(N)]
+            loops = iterative.loop_variants_for(N)
+            for k in range(len(iterative.heapify_algorithms)):
+                for m in (iterative, recursive):
+                    A = list(input)
+                    states = []
+                    swaps = []
+                    for i in loops[k % len(loops)][2]:
+                        m.heapify_algorithms[k][2](A, i, states, swaps)
+                    if m is iterative:
+                        expected = (A, states, swaps)
+                self.assertEqual((A, states, swaps), expected)
+            for i in range(N):
+                self.assertEqual(iterative.min_heap_property(input, i),
+                    recursive.min_heap_property(input, i))
+                self.assertEqual(
+                    iterative.subtree_min_index(input, i, N + 1, -1),
+                    recursive.subtree_min_index(input, i, N + 1, -1))
+
+    def test_subtree_minimum_tree(self):
+        """SubtreeMinimumTree finds the same minimum as subtree_min_index()."""
+        m = BuildHeapMatcher()
+        m.iterative_kernels = False
+        rnd = random.Random(4)
+        for N in (1, 2, 5, 10, 33):
+            A = [rnd.randint(0, 5) for k in range(N)]
+            tree = buildheap.SubtreeMinimumTree(A)
+            for k in range(20):
+                for i in range(N):
+                    self.assertEqual(tree.minimum(i),
+                        m.subtree_min_index(A, i, 6, -1)[1])
+                tree.swap(rnd.randrange(N), rnd.randrange(N))
+
+        # Smallest-instantly-up with and without the tree
+        input = [rnd.randint(0, 20) for k in range(100)]
+        for size in (1, 1000):
+            m.subtree_minimum_size = size
+            A = list(input)
+            swaps = []
+            for i in m.loop_variants_for(100)[4][2]:
+                m.smallest_instantly_up(A, i, None, swaps)
+            if size == 1:
+                expected = (A, swaps)
+        self.assertEqual((A, swaps), expected)
+
+    def test_candidate_trie(self):
+        """Similarities computed in the trie equal those of each candidate."""
+        m = BuildHeapMatcher()
+        input = [14, 17, 13, 15, 16, 12, 11, 19, 18, 10]
+        candidates = [m.build_heap_variant(loop[2], algo[2], input)
+            for loop in m.loop_variants for algo in m.heapify_algorithms]
+        (states, swaps) = candidates[5]
+        states = states[0:3] + candidates[40][0][2:]
+        swaps = swaps[0:2] + candidates[40][1][1:]
+
+        state_trie = buildheap.CandidateTrie()
+        swap_trie = buildheap.CandidateTrie()
+        for (algo_states, algo_swaps) in candidates:
+            state_trie.add(algo_states.hashes, algo_states)
+            swap_trie.add(algo_swaps)
+        self.assertLess(len(swap_trie),
+            sum(len(c[1]) for c in candidates) / 2)
+        self.assertEqual(state_trie.state_similarity(states,
+            m.student_index(input, states)[1]),
+            [m.state_similarity(c[0], states) for c in candidates])
+        self.assertEqual(swap_trie.lcs_similarity(swaps),
+            [m.lcs_similarity(c[1], swaps) for c in candidates])
+
+        # match() gives the same result without the trie
+        m.candidate_trie = False
+        recording = (input, states, swaps)
+        for similarity in ('states', 'lcs'):
+            options = {'similarity': similarity, 'Jaccard': False,
+                'threshold': 0, 'verbosity': 1}
+            expected = []
+            m.match(recording, options, expected)
+            m.candidate_trie = True
+            debug_text = []
+            m.match(recording, options, debug_text)
+            m.candidate_trie = False
+            self.assertEqual(debug_text, expected)
+
+    def test_state_similarity_indexed(self):
+        """Binary search in the index of student's states finds the same
+        furthest match as the linear search."""
+        m = BuildHeapMatcher()
+        rnd = random.Random(2)
+        input = [3, 1, 4, 5, 9, 2, 6, 8, 7, 0]
+        states = [tuple(input)]
+        for k in range(200):
+            A = list(rnd.choice(states[-5:]))
+            (i, j) = rnd.sample(range(10), 2)
+            A[i], A[j] = A[j], A[i]
+            states.append(tuple(A))
+        (hashes, index) = m.student_index(input, states)
+        self.assertIs(m.student_index(list(input), list(states))[1], index)
+        self.assertEqual(sum(len(p) for p in index.values()), len(states))
+        for k in range(50):
+            C = [rnd.choice(states) for n in range(rnd.randint(1, 30))]
+            C_hashes = m.state_hashes(input, C)
+            self.assertEqual(m.state_similarity(C, states, C_hashes, hashes,
+                index), m.state_similarity(C, states))
+
+        # Equal hashes of different states are compared as states
+        collided = [0] * len(states)
+        for k in range(50):
+            C = [rnd.choice(states) for n in range(rnd.randint(1, 30))]
+            expected = m.state_similarity(C, states)
+            self.assertEqual(m.state_similarity(C, states, [0] * len(C),
+                collided, {0: list(range(len(states)))}), expected)
+            self.assertEqual(m.state_similarity(C, states, [0] * len(C),
+                collided), expected)
+
+        # A candidate whose states collide with another one in the trie is
+        # not added
+        trie = buildheap.CandidateTrie()
+        A = m.build_heap_variant((4, 3, 2, 1, 0), m.min_heapify, input)[0]
+        B = m.build_heap_variant((0, 1, 2, 3, 4), m.max_heapify, input)[0]
+        self.assertEqual(trie.add(A.hashes, A), 0)
+        self.assertEqual(trie.add(A.hashes, A), 1)
+        self.assertIsNone(trie.add(A.hashes[0:2] + B.hashes[2:], B))
+        self.assertEqual(trie.state_similarity(states, index),
+            [m.state_similarity(A, states)] * 2)
+
     def test_choose_class(self):
         """Tests choose_class()"""
 
@@ -196,6 +592,78 @@ class TestBuildHeapMatcher(unittest.TestCase):
         self.assertEqual(sim, 4)
         self.assertListEqual(matches, [(1,0), (2,2), (3,4), (5,5)])
 
+    def test_lcs_length(self):
+        """Bit-parallel LCS length equals the dynamic programming result."""
+        m = self.__class__.matcher
+        rnd = random.Random(6)
+        for k in range(200):
+            X = [rnd.randint(0, 4) for i in range(rnd.randint(0, 20))]
+            Y = [rnd.randint(0, 4) for i in range(rnd.randint(0, 80))]
+            self.assertEqual(m.lcs_length(X, Y), m.lcs(X, Y)[0])
+            self.assertEqual(m.lcs_length(Y, X, m.lcs_masks(X)),
+                m.lcs(Y, X)[0])
+
+    def test_lcs_hirschberg(self):
+        """Divide-and-conquer LCS finds the same matches as the table."""
+        m = BuildHeapMatcher()
+        rnd = random.Random(7)
+        for cells in (0, 20, 100000):
+            m.lcs_table_cells = cells
+            for k in range(100):
+                X = [rnd.randint(0, 4) for i in range(rnd.randint(0, 30))]
+                Y = [rnd.randint(0, 4) for i in range(rnd.randint(0, 30))]
+                self.assertEqual(m.lcs_hirschberg(X, Y), m.lcs_table(X, Y))
+
+    def test_lcs_hunt_szymanski(self):
+        """Hunt-Szymanski finds the same matches as the table, and lcs()
+        chooses it for sparse matches."""
+        m = BuildHeapMatcher()
+        rnd = random.Random(9)
+        for alphabet in (1, 3, 50):
+            for k in range(100):
+                X = [rnd.randint(0, alphabet) for i in range(rnd.randint(0, 30))]
+                Y = [rnd.randint(0, alphabet) for i in range(rnd.randint(0, 30))]
+                expected = m.lcs_table(X, Y)
+                self.assertEqual(m.lcs_hunt_szymanski(X, Y), expected)
+                self.assertEqual(m.lcs(X, Y), expected)
+
+        m.lcs_hirschberg = None # not called for sparse matches
+        self.assertEqual(m.lcs("ABCBDAB", "BDCABA"),
+            (4, [(1, 0), (2, 2), (3, 4), (5, 5)]))
+
+    def test_lcs_length_banded(self):
+        """The banded LCS length is a common subsequence length, which is
+        exact when the alignment lies in the band."""
+        m = BuildHeapMatcher()
+        rnd = random.Random(10)
+        for band in (0, 0.25, 100):
+            m.lcs_band = band
+            for k in range(200):
+                X = [rnd.randint(0, 3) for i in range(rnd.randint(0, 20))]
+                Y = [rnd.randint(0, 3) for i in range(rnd.randint(0, 40))]
+                L = m.lcs_table(X, Y)[0]
+                if band == 100:
+                    # The band covers the whole table
+                    self.assertEqual(m.lcs_length_banded(X, Y), L)
+                else:
+                    self.assertLessEqual(m.lcs_length_banded(X, Y), L)
+
+        # A student's sequence with extra swaps spread along it
+        X = [(rnd.randint(0, 8), rnd.randint(0, 8)) for i in range(20)]
+        Y = []
+        for x in X:
+            Y += [(9, 9 - i) for i in range(rnd.randint(8, 12))] + [x]
+        self.assertEqual(m.lcs_band_length(X, Y, 5), (20, False))
+
+        # The band is widened when the alignment reaches its edge
+        Y = [(9, 9)] * 20
+        for x in X:
+            Y += [(9, 9)] * 10 + [x]
+        self.assertEqual(m.lcs_band_length(X, Y, 5), (18, True))
+        m.lcs_band = 0.25
+        m.banded_lcs = True
+        self.assertEqual(m.lcs_similarity(X, Y), 20)
+
     def test_lcs_similarity(self):
 
         lcs = self.__class__.matcher.lcs_similarity
@@ -1325,7 +1793,7 @@ class TestBuildHeapMatcher(unittest.TestCase):
         m = self.__class__.matcher
         heap_size = 10
         input = [i for i in range(heap_size, 0, -1)]
-        sequences = m.single_skips(input)
+        sequences = [C.list() for (i, C) in m.single_skips(input)]
 
         # All swaps of the correct variant (R = recursive):
         #   1     2     3     4     5      6     7      8
@@ -1658,6 +2126,213 @@ class TestBuildHeapMatcher(unittest.TestCase):
 
 
 
+class TestRecordingScanner(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.matcher = BuildHeapMatcher()
+
+    def recording(self, input, swaps):
+        """Helper method which creates a JSAV recording with a redundant
+        step after each swap."""
+        A = list(input)
+        steps = [A]
+        for s in swaps:
+            A = list(A)
+            A[s[0]], A[s[1]] = A[s[1]], A[s[0]]
+            steps += [A, A]
+        return [{'ind': [{'v': x} for x in A],
+                 'style': 'height: 60px; width: 301px;',
+                 'classes': ['jsavcenter']} for A in steps]
+
+    def write_file(self, text):
+        f = tempfile.NamedTemporaryFile('w', suffix = '.json', delete = False)
+        f.write(text)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def downloader_file(self, submissions):
+        """Helper method which writes a file in the layout of
+        JSAV-downloader.py"""
+        text = ('{\n'
+            '  "application" : "JSAV Inspector",\n'
+            '  "version"     : 1,\n'
+            '  "metadata"    : ' + json.dumps({'type': 'buildheap',
+                'submissions_url': 'https://localhost/submissions/'}) + ',\n'
+            '  "submissions" : [\n')
+        comma = ''
+        for (id, recording) in submissions:
+            text += ('  ' + comma + '{\n'
+                '    "id" : ' + str(id) + ',\n'
+                '    "submitter" : 7,\n'
+                '    "points" : 4,\n'
+                '    "max_points" : 5,\n'
+                '    "recording" : ' + json.dumps(recording) + '\n}')
+            comma = ','
+        text += "]\n}\n"
+        return self.write_file(text)
+
+    def test_equivalence(self):
+        """scan_file() + parse_steps() == json.load() + parse_recording()"""
+        m = self.__class__.matcher
+        submissions = [
+            (11, self.recording([14, 17, 13, 15, 16, 12, 11, 19, 18, 10],
+                                [(4, 9), (2, 6), (1, 4), (4, 9), (0, 1)])),
+            (12, self.recording([-1, 5, -30, 2], [(0, 2), (1, 3)])),
+            (13, self.recording([3, 2, 1], []))
+            ]
+        file_name = self.downloader_file(submissions)
+
+        with open(file_name) as json_file:
+            json_data = json.load(json_file)
+        scanned = recording_scanner.scan_file(file_name)
+
+        self.assertEqual(scanned['metadata'], json_data['metadata'])
+        self.assertEqual(len(scanned['submissions']), len(submissions))
+        for (s, expected) in zip(scanned['submissions'],
+                                 json_data['submissions']):
+            self.assertEqual(s['id'], expected['id'])
+            self.assertEqual(s['points'], expected['points'])
+            self.assertEqual(m.parse_steps(s['steps']),
+                             m.parse_recording(expected['recording']))
+
+        # json.dump() layout without extra whitespace
+        compact = self.write_file(json.dumps(json_data))
+        rescanned = recording_scanner.scan_file(compact)
+        self.assertEqual(rescanned['submissions'], scanned['submissions'])
+
+    def test_invalid(self):
+        """Unexpected recordings raise ValueError."""
+        recording = self.recording([3, 2, 1], [(0, 2)])
+        recording[1]['ind'].pop()
+        with self.assertRaises(ValueError):
+            recording_scanner.scan_file(self.downloader_file([(1, recording)]))
+
+        recording = self.recording([3, 2, 1], [(0, 2)])
+        recording[1]['ind'][0]['v'] = 'x'
+        with self.assertRaises(ValueError):
+            recording_scanner.scan_file(self.downloader_file([(1, recording)]))
+
+        # Steps of sizes 3, 2 and 4 have 3 values per step on average
+        recording = self.recording([3, 2, 1], [(0, 2), (0, 1)])
+        recording[1]['ind'].pop()
+        recording[2]['ind'].append({'v': 4})
+        file_name = self.downloader_file([(1, recording)])
+        with self.assertRaises(ValueError):
+            recording_scanner.scan_file(file_name)
+
+        # Matcher falls back to decoding the whole file
+        matcher = MisconceptionMatcher()
+        json_data = matcher.read_file(file_name, False)
+        self.assertEqual(json_data['submissions'][0]['recording'], recording)
+
+
+class TestJSONCodec(unittest.TestCase):
+
+    def test_round_trip(self):
+        """Every installed library decodes what any library encodes."""
+        data = {'metadata': {'course_name': 'Tietorakenteet ja algoritmit Y',
+                             'year': '2019-en', 'id': 22674},
+                'submissions': [{'id': 1, 'points': 4.5,
+                                 'recording': [{'ind': [{'v': 14}]}]}]}
+        for name in jsoncodec.codecs:
+            (loads, dumps) = jsoncodec.codecs[name]
+            for indent in (None, 2, 4):
+                text = dumps(data, sort_keys = True, indent = indent)
+                self.assertIsInstance(text, str)
+                for other in jsoncodec.codecs.values():
+                    self.assertEqual(other[0](text), data)
+                    self.assertEqual(other[0](text.encode('utf-8')), data)
+
+    def test_default(self):
+        """Objects are encoded with the default function, as in
+        ExerciseDL.toJSON()."""
+        class A:
+            def __init__(self):
+                self.x = 1
+        text = jsoncodec.dumps(A(), default = lambda o: o.__dict__,
+            sort_keys = True, indent = 4)
+        self.assertEqual(jsoncodec.loads(text), {'x': 1})
+
+
+class TestDatasetMerger(unittest.TestCase):
+
+    def write_file(self, year, submissions):
+        """Helper method which writes a JSAV inspector file. Parameter
+        submissions is a list of (id, recording)."""
+        data = {'application': 'JSAV Inspector', 'version': 1,
+                'metadata': {'type': 'buildheap', 'year': year},
+                'submissions': [{'id': id, 'submitter': 1, 'points': 1,
+                                 'max_points': 5, 'recording': r}
+                                for (id, r) in submissions]}
+        f = tempfile.NamedTemporaryFile('w', suffix = '.json', delete = False)
+        json.dump(data, f, indent = 2)
+        f.close()
+        self.addCleanup(os.remove, f.name)
+        return f.name
+
+    def recording(self, *values):
+        # Brackets and escaped quotes inside strings must not end a
+        # submission
+        return [{'ind': [{'v': x}], 'style': 's]}"\\', 'classes': ['[{']}
+                for x in values]
+
+    def test_merge(self):
+        file1 = self.write_file(2019, [(5, self.recording(1, 2)),
+                                       (3, self.recording(3))])
+        # 3 again with the same recording but different whitespace, 5 with a
+        # different recording
+        file2 = self.write_file('2019-en', [(4, self.recording(4)),
+                                            (3, self.recording(3)),
+                                            (5, self.recording(2, 1))])
+        output = self.write_file(0, [])
+        report = output + '.csv'
+
+        merger = DatasetMerger()
+        # Small chunks test reading submissions across chunk boundaries
+        merger.chunk_size = 7
+        self.assertEqual(merger.merge([file1, file2], output, report), 3)
+        self.addCleanup(os.remove, report)
+
+        with open(output) as f:
+            merged = json.load(f)
+        self.assertEqual([s['id'] for s in merged['submissions']], [3, 4, 5])
+        self.assertEqual(merged['submissions'][2]['recording'],
+                         self.recording(1, 2))
+        self.assertEqual(merged['metadata']['year'], 2019)
+        self.assertEqual([m['submission_count'] for m in
+                          merged['metadata']['merged_from']], [2, 1])
+        self.assertEqual(sorted(merger.conflicts),
+                         [(3, 'duplicate', file2, file1),
+                          (5, 'conflict', file2, file1)])
+
+        # The merged file has the layout of JSAV-downloader.py
+        scanned = recording_scanner.scan_file(output)
+        self.assertEqual([s['steps'] for s in scanned['submissions']],
+                         [[(3,)], [(4,)], [(1,), (2,)]])
+
+        with open(report) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_type_mismatch(self):
+        file1 = self.write_file(2019, [])
+        file2 = self.write_file(2019, [])
+        with open(file2) as f:
+            data = json.load(f)
+        data['metadata']['type'] = 'quicksort'
+        with open(file2, 'w') as f:
+            json.dump(data, f)
+        with self.assertRaises(Exception):
+            DatasetMerger().merge([file1, file2], file1 + '.out')
+
+    def test_no_input_files(self):
+        output = self.write_file(0, [])
+        with self.assertRaises(Exception) as cm:
+            DatasetMerger().merge([], output)
+        self.assertNotIsInstance(cm.exception, IndexError)
+
+
 class TestDTW(unittest.TestCase):
 
     def print_array(self, A, w, h):
@@ -1720,6 +2395,59 @@ class TestDTW(unittest.TestCase):
             self.assertAlmostEqual(g[i], expected_g[i],
                 msg = (msg.format(i)))
 
+    @unittest.skipIf(dtw_module.numpy is None, "NumPy not installed")
+    def test_numpy(self):
+        """The NumPy and Python implementations compute the same costs, also
+        with a window, and early abandoning keeps distances up to the
+        threshold."""
+        rnd = random.Random(3)
+        for k in range(50):
+            X = [rnd.randint(0, 9) for i in range(rnd.randint(1, 30))]
+            Y = [rnd.randint(0, 9) for i in range(rnd.randint(1, 30))]
+            D = [[self.d(x, y) for x in X] for y in Y]
+            window = max(rnd.randint(0, 5), abs(len(X) - len(Y)))
+            for w in (None, window):
+                self.assertEqual(
+                    list(dtw_module.dtw_python(D, len(X), len(Y), w, None)),
+                    list(dtw_module.dtw_numpy(D, len(X), len(Y), w, None)))
+
+            distance = dtw(X, Y, self.d)
+            self.assertIn(dtw(X, Y, self.d, abandon = distance / 2),
+                (distance, float('inf')))
+            self.assertEqual(dtw(X, Y, self.d, abandon = distance), distance)
+
+    def test_window(self):
+        """Cells outside of the Sakoe-Chiba window have infinite cost."""
+        X = [0, 4, 3, 1, 4, 3, 2, 0]
+        Y = [0, 4, 2, 0, 4, 2, 0, 4, 2]
+        g = dtw(X, Y, self.d, return_array = True, window = 1)
+        M = len(X)
+        for j in range(len(Y)):
+            for i in range(M):
+                if abs(i - j) > 1:
+                    self.assertEqual(g[j * M + i], float('inf'))
+        self.assertGreaterEqual(g[-1], dtw(X, Y, self.d))
+        self.assertEqual(dtw(X, Y, self.d, window = 9), dtw(X, Y, self.d))
+
+    def test_search(self):
+        """dtw_search() finds the nearest candidate with pruning."""
+        rnd = random.Random(5)
+        Q = [rnd.randint(0, 9) for i in range(20)]
+        candidates = [[rnd.randint(0, 9) + k for i in range(rnd.randint(10,
+            30))] for k in range(40)]
+        candidates.append(Q[:10] + [8] + Q[10:])
+        for window in (None, 3):
+            distances = [dtw(Q, C, self.d, window = window)
+                for C in candidates]
+            (k, distance, statistics) = dtw_module.dtw_search(Q, candidates,
+                window = window)
+            self.assertEqual(distance, min(distances))
+            self.assertEqual(k, distances.index(distance))
+            self.assertEqual(sum(statistics.values()), len(candidates))
+            self.assertLess(statistics['dtw'], len(candidates))
+        self.assertEqual(dtw_module.dtw_search(Q, []), (None, float('inf'),
+            {'dtw': 0, 'LB_Kim': 0, 'LB_Keogh': 0}))
+
 class TestMainLoopGenerator(unittest.TestCase):
     
     def test_levels_negative_size(self):
@@ -1811,6 +2539,106 @@ class TestMainLoopGenerator(unittest.TestCase):
         self.assertEqual(g.heap_size, 16)
         self.assertListEqual(g.levels, [(0, 0), (1, 2), (3, 6), (7, 7)])
 
+    def test_loop_variants(self):
+        g = MainLoopGenerator()
+        m = BuildHeapMatcher()
+        self.assertEqual(g.loop_variants(10), m.loop_variants)
+
+        #                   [0]
+        #           ┌────────┴──────────┐
+        #          [1]                 [2]
+        #       ┌───┴────┐         ┌────┴────┐
+        #      [3]      [4]       [5]       [6]
+        #     ┌─┴─┐   ┌──┴─┐    ┌──┴─┐    ┌──┴─┐
+        #    [7] [8] [9] [10] [11] [12] [13] [14]
+        #   ┌─┘
+        # [15]
+        sequences = [v[2] for v in g.loop_variants(16)]
+        self.assertListEqual(sequences, [
+            (7, 6, 5, 4, 3, 2, 1, 0),
+            (7, 3, 4, 5, 6, 2, 1, 0),
+            (7, 6, 5, 4, 3, 1, 2, 0),
+            (7, 3, 4, 5, 6, 1, 2, 0),
+            (0, 1, 2, 3, 4, 5, 6, 7),
+            (0, 1, 2, 6, 5, 4, 3, 7),
+            (0, 2, 1, 6, 5, 4, 3, 7),
+            (7, 3, 1, 4, 0, 5, 2, 6)])
+        self.assertIs(g.loop_variants(16), g.loop_variants(16))
+        for N in (1, 2, 3, 100, 1001):
+            for v in g.loop_variants(N):
+                self.assertListEqual(sorted(v[2]), list(range(N // 2)))
+
+    def test_zigzag_top_down(self):
+        """Top-down variants follow the same rule at every heap size:
+        "Zigzag top-down LR" alternates direction from the root level, and
+        "Zigzag top-down RL" traverses each level from right to left."""
+        g = MainLoopGenerator()
+        for N in (10, 16, 31, 1000):
+            variants = g.loop_variants(N)
+            for (code, alternate) in ((600, True), (700, False)):
+                sequence = [v for v in variants if v[0] == code][0][2]
+                left_to_right = False # the root level
+                k = 0
+                for (l, r) in g.levels:
+                    level = sequence[k : k + r - l + 1]
+                    k += r - l + 1
+                    self.assertEqual(sorted(level), list(range(l, r + 1)))
+                    self.assertEqual(list(level), sorted(level,
+                        reverse = not left_to_right))
+                    if alternate:
+                        left_to_right = not left_to_right
+                self.assertEqual(k, len(sequence))
+
+    def test_large_heap_match(self):
+        # Correct Build-heap of 50 elements
+        m = BuildHeapMatcher()
+        input = random.Random(3).sample(range(1000), 50)
+        states, swaps = m.build_heap_variant(m.loop_variants_for(50)[0][2],
+            m.min_heapify, input)
+        parsed = (input, list(states), [s[0:2] for s in swaps])
+        self.assertEqual(m.match(parsed), 100)
+        self.assertEqual(m.replicated_study_match(parsed),
+            ('Correct', 'Finished'))
+
+    def test_very_large_heap_match(self):
+        # A student who has done the first swaps of Build-heap of 10000
+        # elements
+        m = BuildHeapMatcher()
+        N = 10000
+        input = random.Random(4).sample(range(10 * N), N)
+        states, swaps = m.build_heap_variant(m.loop_variants_for(N)[0][2],
+            m.min_heapify, input)
+        parsed = (input, states[0:301], [s[0:2] for s in swaps[0:300]])
+        start = time.perf_counter()
+        self.assertEqual(m.match(parsed), 100)
+        self.assertLess(time.perf_counter() - start, 60)
+
+    def test_large_heap_replicated_study_match(self):
+        # Build-heap of 1000 elements where a swap is skipped, and a student
+        # who has done the first swaps of Build-heap of 10000 elements
+        m = BuildHeapMatcher()
+        N = 1000
+        input = random.Random(5).sample(range(10 * N), N)
+        skips = m.single_skips(input)
+        for k in range(N // 4):
+            (i, states) = next(skips)
+        parsed = (input, states.list(), [s[0:2] for s in states.swaps])
+        start = time.perf_counter()
+        self.assertEqual(m.replicated_study_match(parsed),
+            ('Single-Skip', 'Finished'))
+        self.assertLess(time.perf_counter() - start, 20)
+
+        N = 10000
+        input = random.Random(4).sample(range(10 * N), N)
+        states, swaps = m.build_heap_variant(m.loop_variants_for(N)[0][2],
+            m.min_heapify, input)
+        parsed = (input, [states[k] for k in range(301)],
+            [s[0:2] for s in swaps[0:300]])
+        start = time.perf_counter()
+        self.assertEqual(m.replicated_study_match(parsed),
+            ('Unknown', 'Unfinished'))
+        self.assertLess(time.perf_counter() - start, 60)
+
 if __name__ == "__main__":
     #import sys;sys.argv = ['', 'Test.testName']
     unittest.main()